@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# benchmarks/bench_capture.py
+"""
+Throughput benchmark for the Telegram capture pipeline.
+
+Replays synthetic getUpdates payloads (mixed zh/en text, varying sizes and
+#daily/#threads/#mastodon tag mixes) against a local fake Telegram/Mastodon
+server, inside a throwaway working directory:
+
+  * stage pass - each message goes through parse, language detection, daily
+    append, queue write and reply one stage at a time, timing each stage
+  * end-to-end pass - process_telegram_messages() drains the same updates
+    from the fake getUpdates endpoint
+
+Results are written as JSON so runs can be compared:
+
+    python benchmarks/bench_capture.py --messages 200 --output benchmarks/results/before.json
+    python benchmarks/bench_capture.py --messages 200 --compare benchmarks/results/before.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import logging
+import tempfile
+import platform
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'scripts')
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, SCRIPTS_DIR)
+
+from fake_api import FakeAPIServer
+
+USER_ID = 424242
+BOT_TOKEN = 'bench-token'
+
+ZH_TEXT = ("学校在自习位置上也放了光疗灯看来温哥华雨季的阴天真的很难熬上周坚持了几天的早睡早起"
+           "这周全崩了连带着早上骑车的习惯也断掉了根本原因还是熬夜从今天起要恢复点前不带手机进卧室")
+EN_WORDS = ("capture thought focus rain morning coffee bike sleep idea draft write read book "
+            "music vancouver school project note queue post window").split()
+TAG_MIXES = ["", "#daily", "#threads", "#mastodon", "#daily #threads",
+             "#threads #mastodon", "#daily #threads #mastodon"]
+SIZES = {"short": (10, 60), "medium": (200, 800), "long": (2000, 4000)}
+
+def synthetic_text(rng):
+    """One message: zh, en or mixed prose of a random size, plus a tag mix"""
+    low, high = SIZES[rng.choices(list(SIZES), weights=[6, 3, 1])[0]]
+    target = rng.randint(low, high)
+    language = rng.choice(["zh", "en", "mixed"])
+    parts = []
+    length = 0
+    while length < target:
+        if language == "zh" or (language == "mixed" and rng.random() < 0.5):
+            start = rng.randrange(len(ZH_TEXT) - 12)
+            chunk = ZH_TEXT[start:start + rng.randint(4, 12)] + "。"
+        else:
+            chunk = " ".join(rng.choice(EN_WORDS) for _ in range(rng.randint(3, 10))) + ". "
+        if rng.random() < 0.1:
+            chunk += "\n"
+        parts.append(chunk)
+        length += len(chunk)
+    tags = rng.choice(TAG_MIXES)
+    return "".join(parts) + (f" {tags}" if tags else "")
+
+def synthetic_updates(count, seed, first_update_id=1):
+    """getUpdates result entries from the authorized user"""
+    rng = random.Random(seed)
+    updates = []
+    for i in range(count):
+        update_id = first_update_id + i
+        updates.append({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "from": {"id": USER_ID, "is_bot": False, "first_name": "Bench"},
+                "chat": {"id": USER_ID, "type": "private"},
+                "date": int(time.time()),
+                "text": synthetic_text(rng),
+            },
+        })
+    return updates
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def summarize(samples):
+    """p50/p99/mean in milliseconds for a list of durations in seconds"""
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 4) if samples else None,
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 4) if samples else None,
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 4) if samples else None,
+    }
+
+def tree_size(*paths):
+    """Total size in bytes of every file under the given directories"""
+    total = 0
+    for path in paths:
+        for root, _, files in os.walk(path):
+            for name in files:
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def io_chars_written():
+    """Bytes this process has passed to write() so far (Linux only)"""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def run_stage_pass(updates):
+    """Time each pipeline stage separately for every message"""
+    import queue_store
+    from utils import detect_language, send_telegram_message
+    from message_parser import parse_message
+    from content_processor import (vancouver_now, daily_digest_info,
+                                   render_daily_section, write_daily_sections, make_queue_post)
+
+    timings = {"parse": [], "language_detection": [], "daily_append": [], "queue_write": [], "reply": []}
+    for update in updates:
+        message = update["message"]
+        text = message["text"]
+
+        # The parser also produces language stats; the standalone detector is
+        # timed separately because other callers still use it
+        start = time.perf_counter()
+        parsed = parse_message(text)
+        timings["parse"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        detect_language(text)
+        timings["language_detection"].append(time.perf_counter() - start)
+
+        if parsed.wants_daily:
+            start = time.perf_counter()
+            now = vancouver_now()
+            filename, title = daily_digest_info(now, parsed.language)
+            write_daily_sections(filename, [render_daily_section(parsed.clean_text, now)], title)
+            timings["daily_append"].append(time.perf_counter() - start)
+
+        if parsed.platforms:
+            start = time.perf_counter()
+            queue_store.enqueue_many({platform: [make_queue_post(parsed.clean_text, message["message_id"])]
+                                      for platform in parsed.platforms})
+            timings["queue_write"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        send_telegram_message(message["chat"]["id"], "✅ bench")
+        timings["reply"].append(time.perf_counter() - start)
+
+    return {stage: summarize(samples) for stage, samples in timings.items()}
+
+def run_end_to_end(updates):
+    """Drain all updates through process_telegram_messages and time it"""
+    import telegram_handler
+
+    start = time.perf_counter()
+    telegram_handler.process_telegram_messages()
+    telegram_handler.replies.flush(wait=True)
+    elapsed = time.perf_counter() - start
+    return {
+        "seconds": round(elapsed, 4),
+        "messages_per_second": round(len(updates) / elapsed, 2) if elapsed else None,
+    }
+
+def run_benchmark(message_count, seed):
+    updates = synthetic_updates(message_count, seed)
+    total_chars = sum(len(update["message"]["text"]) for update in updates)
+
+    original_cwd = os.getcwd()
+    with FakeAPIServer(updates) as api, tempfile.TemporaryDirectory(prefix='flow-bench-') as workdir:
+        # The scripts read these at import time and use paths relative to the repo root
+        os.environ['TELEGRAM_BOT_TOKEN'] = BOT_TOKEN
+        os.environ['AUTHORIZED_USER_ID'] = str(USER_ID)
+        os.environ['TELEGRAM_API_BASE'] = api.base_url
+        os.chdir(workdir)
+        try:
+            for directory in ('bot_data', 'content/daily'):
+                os.makedirs(directory, exist_ok=True)
+            logging.disable(logging.WARNING)
+
+            import utils
+            # Measure our own overhead, not the production rate limits
+            utils.HOST_RATE_LIMITS['127.0.0.1'] = (1e9, 1e9)
+
+            # Stage pass
+            size_before, wchar_before = tree_size('bot_data', 'content'), io_chars_written()
+            stages = run_stage_pass(updates)
+            stage_bytes = tree_size('bot_data', 'content') - size_before
+            stage_wchar = (io_chars_written() - wchar_before) if wchar_before is not None else None
+            stage_requests = dict(api.requests)
+
+            # End-to-end pass over a fresh tree
+            import queue_store, search_index
+            queue_store.close_connections()
+            search_index.close_connections()
+            for directory in ('bot_data', 'content'):
+                for root, _, files in os.walk(directory):
+                    for name in files:
+                        os.remove(os.path.join(root, name))
+            api.requests.clear()
+
+            size_before, wchar_before = tree_size('bot_data', 'content'), io_chars_written()
+            end_to_end = run_end_to_end(updates)
+            e2e_bytes = tree_size('bot_data', 'content') - size_before
+            e2e_wchar = (io_chars_written() - wchar_before) if wchar_before is not None else None
+            e2e_requests = dict(api.requests)
+
+            queue_store.close_connections()
+            search_index.close_connections()
+        finally:
+            logging.disable(logging.NOTSET)
+            os.chdir(original_cwd)
+
+    return {
+        "benchmark": "capture",
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "messages": message_count,
+        "seed": seed,
+        "input_chars": total_chars,
+        "stages": stages,
+        "stage_pass": {
+            "bytes_stored_per_message": round(stage_bytes / message_count, 1),
+            "bytes_written_per_message": round(stage_wchar / message_count, 1) if stage_wchar is not None else None,
+            "requests": stage_requests,
+        },
+        "end_to_end": dict(end_to_end, **{
+            "bytes_stored_per_message": round(e2e_bytes / message_count, 1),
+            "bytes_written_per_message": round(e2e_wchar / message_count, 1) if e2e_wchar is not None else None,
+            "requests": e2e_requests,
+        }),
+    }
+
+def compare(current, baseline):
+    """Print per-metric changes against an earlier result file"""
+    print(f"\nCompared with {baseline.get('timestamp')}:")
+    for stage, stats in current["stages"].items():
+        before = baseline.get("stages", {}).get(stage, {})
+        for metric in ("p50_ms", "p99_ms"):
+            if stats.get(metric) is not None and before.get(metric):
+                change = (stats[metric] - before[metric]) / before[metric] * 100
+                print(f"  {stage:<20} {metric}: {before[metric]:.4f} -> {stats[metric]:.4f} ({change:+.1f}%)")
+    for metric in ("messages_per_second", "bytes_written_per_message"):
+        before = baseline.get("end_to_end", {}).get(metric)
+        after = current["end_to_end"].get(metric)
+        if before and after is not None:
+            print(f"  end_to_end {metric}: {before} -> {after} ({(after - before) / before * 100:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the capture pipeline')
+    parser.add_argument('--messages', type=int, default=200, help='Number of synthetic messages')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the payloads')
+    parser.add_argument('--output', help='Where to save the JSON results '
+                        '(default: benchmarks/results/capture-<timestamp>.json)')
+    parser.add_argument('--compare', help='Earlier result JSON to compare against')
+    args = parser.parse_args()
+
+    result = run_benchmark(args.messages, args.seed)
+
+    output = args.output or os.path.join(
+        BENCH_DIR, 'results', f"capture-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+
+    print(f"{args.messages} messages, {result['input_chars']} chars")
+    for stage, stats in result["stages"].items():
+        print(f"  {stage:<20} p50 {stats['p50_ms']} ms  p99 {stats['p99_ms']} ms  (n={stats['count']})")
+    e2e = result["end_to_end"]
+    print(f"  end-to-end: {e2e['messages_per_second']} msg/s, "
+          f"{e2e['bytes_written_per_message']} bytes written/msg, requests {e2e['requests']}")
+    print(f"Saved results to {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(result, json.load(f))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# benchmarks/bench_language.py
+"""
+Golden-corpus check and timing for language detection.
+
+Runs utils.detect_language (exact and sampling modes) and
+message_parser.parse_message over every Markdown file under content/, the
+captured thoughts in bot_data/, synthetic capture messages and a set of
+edge cases. Compares each answer with the original per-character loop kept
+below as the reference. Exits non-zero if the exact detector or the parser
+ever disagrees with it.
+
+    python benchmarks/bench_language.py
+    python benchmarks/bench_language.py --output benchmarks/results/language.json
+"""
+import os
+import sys
+import json
+import glob
+import time
+import random
+import argparse
+import platform
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'scripts'))
+
+import utils
+from utils import detect_language
+from message_parser import parse_message
+from bench_capture import synthetic_text
+
+def reference_detect_language(text):
+    """The original character-by-character detector"""
+    chinese_char_count = 0
+    total_count = 0
+    for char in text:
+        if ord(char) > 127:
+            if '一' <= char <= '鿿':
+                chinese_char_count += 1
+        total_count += 1
+    if total_count == 0:
+        return 'zh'
+    if chinese_char_count / total_count > 0.2:
+        return 'zh'
+    else:
+        return 'en'
+
+EDGE_CASES = [
+    "", "3", "12", "just now", "   ", "\n", "中", "a中", "abcd中", "abcde中",
+    # Exactly at and just around the 20% threshold
+    "中" + "a" * 4, "中" + "a" * 3, "中中" + "a" * 8, "中中" + "a" * 7,
+    # Just outside the counted range (CJK Extension A, compatibility ideographs)
+    "㐀䶿䷿", "豈頻", "一鿿",
+    "emoji 🎉🎉 only", "日本語のテキスト", "한국어 텍스트",
+]
+
+def build_corpus(seed=1, synthetic_count=500):
+    """(name, text) pairs making up the golden corpus"""
+    corpus = [(f"edge:{i}", text) for i, text in enumerate(EDGE_CASES)]
+
+    for path in sorted(glob.glob(os.path.join(REPO_DIR, 'content', '**', '*.md'), recursive=True)):
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        name = os.path.relpath(path, REPO_DIR)
+        corpus.append((name, text))
+        # Each paragraph on its own, like a captured message
+        for i, paragraph in enumerate(part for part in text.split("\n\n") if part.strip()):
+            corpus.append((f"{name}#p{i}", paragraph))
+
+    for path in glob.glob(os.path.join(REPO_DIR, 'bot_data', 'untagged_thoughts.json')):
+        with open(path, 'r', encoding='utf-8') as f:
+            for i, thought in enumerate(json.load(f)):
+                corpus.append((f"untagged:{i}", thought.get("content", "")))
+
+    rng = random.Random(seed)
+    for i in range(synthetic_count):
+        corpus.append((f"synthetic:{i}", synthetic_text(rng)))
+
+    # Long concatenations to exercise the cache and sampling paths
+    texts = [text for _, text in corpus]
+    for i in range(20):
+        corpus.append((f"long:{i}", "\n".join(rng.sample(texts, min(len(texts), 60)))))
+    return corpus
+
+def time_all(function, texts, repeat=3):
+    """Best-of-N total seconds for running function over every text"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            function(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and time language detection on a golden corpus')
+    parser.add_argument('--output', help='Save results as JSON to this path')
+    args = parser.parse_args()
+
+    corpus = build_corpus()
+    texts = [text for _, text in corpus]
+    expected = [reference_detect_language(text) for text in texts]
+
+    mismatches = {"exact": [], "sampled": [], "parser": []}
+    for (name, text), want in zip(corpus, expected):
+        utils._language_cache.clear()
+        if detect_language(text) != want:
+            mismatches["exact"].append(name)
+        utils._language_cache.clear()
+        if detect_language(text, sample=True) != want:
+            mismatches["sampled"].append(name)
+        if parse_message(text).language != want:
+            mismatches["parser"].append(name)
+
+    def cold(text):
+        utils._language_cache.clear()
+        return detect_language(text)
+
+    timings = {
+        "reference_s": time_all(reference_detect_language, texts),
+        "exact_cold_s": time_all(cold, texts),
+        "exact_warm_s": time_all(detect_language, texts),
+        "sampled_s": time_all(lambda text: detect_language(text, sample=True), texts),
+        "parser_s": time_all(parse_message, texts),
+    }
+
+    result = {
+        "benchmark": "language",
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "texts": len(texts),
+        "chars": sum(len(text) for text in texts),
+        "mismatches": {mode: len(names) for mode, names in mismatches.items()},
+        "mismatched_texts": mismatches,
+        "timings": {name: round(seconds, 6) for name, seconds in timings.items()},
+    }
+
+    print(f"{result['texts']} texts, {result['chars']} chars")
+    for mode, names in mismatches.items():
+        print(f"  {mode:<8} mismatches: {len(names)}" + (f" {names[:5]}" if names else ""))
+    for name, seconds in timings.items():
+        print(f"  {name:<14} {seconds * 1000:.2f} ms ({timings['reference_s'] / seconds:.1f}x reference)")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"Saved results to {args.output}")
+
+    # Sampling is allowed to differ on texts near the threshold; the exact
+    # detector and the parser are not
+    return 1 if mismatches["exact"] or mismatches["parser"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# benchmarks/bench_startup.py
+"""
+Startup-time budget for telegram_handler.py.
+
+Most cron runs find nothing to do, so the cost of a run is mostly
+interpreter start plus imports. This runs a few cheap invocations in a
+throwaway working directory, each several times:
+
+  * --help
+  * --action search over an empty content tree
+  * --action list_queues (empty queues)
+  * --action process against a local fake Telegram API with no updates
+
+and reports the median wall time of each minus a baseline, i.e. the time
+our own code adds. The baseline is a bare `python -c pass`, or
+`python -c "import requests"` for the commands that have to talk to
+Telegram and so can't avoid loading requests. Each command is also re-run
+with -X importtime, and the benchmark fails if a module that belongs to
+another code path (yaml, pytz, ...) shows up, or if any overhead is over
+budget:
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 20 --budget-ms 100 --output benchmarks/results/startup.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+HANDLER = os.path.join(os.path.dirname(BENCH_DIR), 'scripts', 'telegram_handler.py')
+sys.path.insert(0, BENCH_DIR)
+
+from fake_api import FakeAPIServer
+
+DEFAULT_RUNS = 10
+DEFAULT_BUDGET_MS = 100
+TOP_IMPORTS = 8
+
+# Interpreter start alone, and with the HTTP library every Telegram call needs
+BARE = 'pass'
+WITH_REQUESTS = 'import requests'
+# Modules that belong to other code paths; each one is imported where it is used
+MESSAGE_PATH = ("yaml", "pytz", "http.server", "content_processor", "sns_manager", "search_index")
+
+def commands():
+    """name -> (handler arguments, baseline code, modules it must not import)"""
+    return {
+        "--help": (['--help'], BARE, MESSAGE_PATH + ("requests",)),
+        "search": (['--action', 'search', '--query', 'startup'], BARE,
+                   ("requests", "pytz", "http.server", "content_processor", "sns_manager")),
+        # Sends the listing to Telegram, so it needs requests
+        "list_queues": (['--action', 'list_queues'], WITH_REQUESTS, MESSAGE_PATH),
+        "process (no updates)": (['--action', 'process'], WITH_REQUESTS, MESSAGE_PATH),
+    }
+
+def median_seconds(argv, env, cwd, runs):
+    """Median wall time of running python with argv"""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + argv, env=env, cwd=cwd, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+def imported_modules(argv, env, cwd):
+    """[(cumulative microseconds, module)] from -X importtime, slowest first"""
+    completed = subprocess.run([sys.executable, '-X', 'importtime'] + argv, env=env, cwd=cwd,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.append((int(cumulative), name.strip()))
+    modules.sort(reverse=True)
+    return modules
+
+def run_benchmark(runs):
+    with tempfile.TemporaryDirectory(prefix='bench-startup-') as workdir, FakeAPIServer() as server:
+        env = dict(os.environ,
+                   TELEGRAM_API_BASE=server.base_url,
+                   TELEGRAM_BOT_TOKEN='bench-token',
+                   AUTHORIZED_USER_ID='424242',
+                   FLOW_METRICS_PATH=os.path.join(workdir, 'metrics.prom'))
+        # Warm the bytecode cache so compiling isn't timed
+        for handler_args, _, _ in commands().values():
+            subprocess.run([sys.executable, HANDLER] + handler_args, env=env, cwd=workdir,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        baselines = {code: median_seconds(['-c', code], env, workdir, runs) for code in (BARE, WITH_REQUESTS)}
+        results = {}
+        for name, (handler_args, baseline_code, lazy_modules) in commands().items():
+            argv = [HANDLER] + handler_args
+            wall = median_seconds(argv, env, workdir, runs)
+            modules = imported_modules(argv, env, workdir)
+            loaded = {module for _, module in modules}
+            results[name] = {
+                "median_ms": round(wall * 1000, 1),
+                "baseline": baseline_code,
+                "overhead_ms": round((wall - baselines[baseline_code]) * 1000, 1),
+                "modules": len(modules),
+                "unexpected_imports": sorted(loaded & set(lazy_modules)),
+                "top_imports": [{"module": module, "cumulative_ms": round(micros / 1000, 1)}
+                                for micros, module in modules[:TOP_IMPORTS]],
+            }
+
+    return {
+        "benchmark": "startup",
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": runs,
+        "baselines_ms": {code: round(seconds * 1000, 1) for code, seconds in baselines.items()},
+        "commands": results,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Check telegram_handler.py startup time against a budget')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help='Runs per command')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help='Most time a command may add on top of its baseline')
+    parser.add_argument('--output', help='Save results as JSON to this path')
+    args = parser.parse_args()
+
+    result = run_benchmark(args.runs)
+    result["budget_ms"] = args.budget_ms
+
+    for code, ms in result["baselines_ms"].items():
+        print(f"python -c '{code}': {ms} ms (median of {args.runs})")
+    failures = []
+    for name, stats in result["commands"].items():
+        print(f"  {name:<22} {stats['median_ms']:7.1f} ms  ({stats['overhead_ms']:+} ms over "
+              f"'{stats['baseline']}', {stats['modules']} modules)")
+        print("    slowest imports: " + ", ".join(f"{entry['module']} {entry['cumulative_ms']} ms"
+                                                  for entry in stats["top_imports"]))
+        if stats["overhead_ms"] > args.budget_ms:
+            failures.append(f"{name} adds {stats['overhead_ms']} ms, budget is {args.budget_ms} ms")
+        if stats["unexpected_imports"]:
+            failures.append(f"{name} imports {', '.join(stats['unexpected_imports'])}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+# benchmarks/fake_api.py
+"""
+Local stand-in for the Telegram Bot API and a Mastodon instance.
+
+Serves getUpdates from a canned list of updates (honouring offset/limit),
+getFile and file downloads from a dict of canned files, accepts sendMessage
+and /api/v1/statuses, and counts every request so a benchmark can report
+how many round-trips a run made.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+class FakeAPIServer:
+    """Run the fake Telegram/Mastodon API on 127.0.0.1 in a background thread"""
+
+    def __init__(self, updates=None, files=None):
+        self.updates = list(updates or [])
+        # file_id -> bytes served by getFile and /file/bot<token>/<file_id>
+        self.files = dict(files or {})
+        self.requests = {}
+        self.sent_messages = []
+        self.statuses = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def get_updates(self, offset=0, limit=100):
+        """Updates with update_id >= offset, like the real getUpdates"""
+        pending = [update for update in self.updates if update["update_id"] >= offset]
+        return pending[:limit]
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Avoid Nagle/delayed-ACK stalls on keep-alive connections
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _read_body(self):
+                length = int(self.headers.get('Content-Length', 0))
+                return self.rfile.read(length) if length else b''
+
+            def _reply(self, payload, status=200):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.endswith('/getUpdates'):
+                    api._count('getUpdates')
+                    query = parse_qs(url.query)
+                    offset = int(query.get('offset', ['0'])[0])
+                    limit = int(query.get('limit', ['100'])[0])
+                    self._reply({"ok": True, "result": api.get_updates(offset, limit)})
+                elif url.path.endswith('/getFile'):
+                    api._count('getFile')
+                    file_id = parse_qs(url.query).get('file_id', [''])[0]
+                    if file_id in api.files:
+                        self._reply({"ok": True, "result": {"file_id": file_id, "file_path": file_id,
+                                                            "file_size": len(api.files[file_id])}})
+                    else:
+                        self._reply({"ok": False, "description": "Bad Request: invalid file_id"}, 400)
+                elif url.path.startswith('/file/'):
+                    api._count('file')
+                    data = api.files.get(url.path.rsplit('/', 1)[-1])
+                    if data is None:
+                        self._reply({"ok": False, "description": "Not Found"}, 404)
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/octet-stream')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                else:
+                    self._reply({"ok": False, "description": "Not Found"}, 404)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                body = self._read_body()
+                if url.path.endswith('/sendMessage'):
+                    api._count('sendMessage')
+                    with api.lock:
+                        api.sent_messages.append(json.loads(body or b'{}'))
+                    self._reply({"ok": True, "result": {}})
+                elif url.path == '/api/v1/statuses':
+                    api._count('statuses')
+                    with api.lock:
+                        api.statuses.append(parse_qs(body.decode('utf-8')))
+                    self._reply({"id": str(len(api.statuses))})
+                else:
+                    self._reply({"ok": False, "description": "Not Found"}, 404)
+
+        return Handler
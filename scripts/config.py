@@ -0,0 +1,130 @@
+# scripts/config.py
+"""
+Bot configuration from bot_data/config.json, validated and compiled once.
+
+    {"sns_channels": {"mastodon": {"enabled": true, "post_windows": ["09:00", "21:00"],
+                                   "credentials": {"instance": "...", "token": "..."}}},
+     "blog": {"daily_digest_time": "21:45", "reminder_time": "21:45"}}
+
+load() returns a Config whose channels carry their post windows already
+parsed into sorted (hour, minute) pairs. Each call only stats the file;
+it is re-read when its mtime or size changes, so a long-running serve
+process picks up edits without a restart. A bad edit is reported and the
+last good configuration stays in use.
+"""
+import os
+import json
+import logging
+import threading
+from dataclasses import dataclass, field
+
+logger = logging.getLogger("Config")
+
+CONFIG_PATH = 'bot_data/config.json'
+DEFAULT_DIGEST_TIME = "21:45"
+
+class ConfigError(ValueError):
+    """The configuration file is missing or invalid"""
+
+@dataclass(frozen=True)
+class Channel:
+    """One SNS channel"""
+    name: str
+    enabled: bool = False
+    # Sorted, de-duplicated (hour, minute) pairs
+    windows: tuple = ()
+    credentials: dict = field(default_factory=dict)
+
+    @property
+    def window_labels(self):
+        """The windows as "HH:MM" strings, for log messages"""
+        return [f"{hour:02d}:{minute:02d}" for hour, minute in self.windows]
+
+@dataclass(frozen=True)
+class BlogConfig:
+    """Digest settings"""
+    daily_digest_time: tuple = (21, 45)
+    reminder_time: tuple = (21, 45)
+
+@dataclass(frozen=True)
+class Config:
+    """The whole configuration"""
+    channels: dict = field(default_factory=dict)
+    blog: BlogConfig = field(default_factory=BlogConfig)
+
+    @property
+    def enabled_channels(self):
+        """The enabled channels, in file order"""
+        return [channel for channel in self.channels.values() if channel.enabled]
+
+# path -> ((mtime_ns, size), Config)
+_cache = {}
+_lock = threading.Lock()
+
+def parse_time(value, where):
+    """Parse "HH:MM" into (hour, minute)"""
+    try:
+        hour, minute = value.split(':')
+        hour, minute = int(hour), int(minute)
+    except (AttributeError, ValueError):
+        raise ConfigError(f"{where}: expected \"HH:MM\", got {value!r}")
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ConfigError(f"{where}: {value!r} is not a time of day")
+    return hour, minute
+
+def _expect(value, kind, where):
+    if not isinstance(value, kind):
+        raise ConfigError(f"{where}: expected {kind.__name__}, got {type(value).__name__}")
+    return value
+
+def parse_config(data):
+    """Validate decoded config.json data and build a Config"""
+    _expect(data, dict, "config")
+    channels = {}
+    for name, raw in _expect(data.get("sns_channels", {}), dict, "sns_channels").items():
+        where = f"sns_channels.{name}"
+        _expect(raw, dict, where)
+        windows = _expect(raw.get("post_windows", []), list, f"{where}.post_windows")
+        channels[name] = Channel(
+            name=name,
+            enabled=_expect(raw.get("enabled", False), bool, f"{where}.enabled"),
+            windows=tuple(sorted({parse_time(window, f"{where}.post_windows") for window in windows})),
+            credentials=_expect(raw.get("credentials", {}), dict, f"{where}.credentials"),
+        )
+
+    blog = _expect(data.get("blog", {}), dict, "blog")
+    digest_time = parse_time(blog.get("daily_digest_time", DEFAULT_DIGEST_TIME), "blog.daily_digest_time")
+    reminder_time = parse_time(blog.get("reminder_time", blog.get("daily_digest_time", DEFAULT_DIGEST_TIME)),
+                               "blog.reminder_time")
+    return Config(channels=channels, blog=BlogConfig(digest_time, reminder_time))
+
+def load(path=CONFIG_PATH):
+    """The current Config, re-read only if the file changed since the last call.
+
+    Raises ConfigError if the file is missing or invalid and no earlier
+    version of it was loaded.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        raise ConfigError(f"Cannot read {path}: {e}")
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    with _lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                config = parse_config(json.load(f))
+        except (OSError, ValueError) as e:
+            if cached is None:
+                raise ConfigError(f"Invalid {path}: {e}")
+            logger.error(f"Ignoring invalid {path}, keeping the previous configuration: {e}")
+            # Don't re-parse the same broken file on every call
+            _cache[path] = (version, cached[1])
+            return cached[1]
+        if cached is not None:
+            logger.info(f"Reloaded {path}")
+        _cache[path] = (version, config)
+        return config
@@ -0,0 +1,287 @@
+# scripts/content_index.py
+"""
+Persistent index of the Hugo content tree.
+
+Maps each Markdown file under content/daily, content/posts and
+content/xikang to its front matter, word count, timestamped sections and
+checksum, stored in bot_data/content_index.json and committed with the
+rest of bot_data/, so a fresh checkout starts from the last run's index.
+
+write_daily_sections updates a digest's entry as it appends to it, and
+lookups for one day only check that day's files, so nothing on the
+capture or !day path walks the tree. A full refresh (--action
+index_content) only stats the tree: files whose mtime and size are
+unchanged are not opened, and files that were touched but whose checksum
+still matches are not re-parsed.
+"""
+import os
+import re
+import json
+import hashlib
+import threading
+from datetime import date, datetime
+
+from utils import atomic_write_text, file_lock
+
+INDEX_PATH = 'bot_data/content_index.json'
+CONTENT_DIRS = ('content/daily', 'content/posts', 'content/xikang')
+# Bump when the entry layout changes so old indexes are rebuilt
+INDEX_VERSION = 1
+# Characters of each section kept for previews
+PREVIEW_LENGTH = 80
+
+# "## 07:48" headings that start each captured section of a digest
+SECTION_PATTERN = re.compile(r'^## (\d{1,2}:\d{2})[ \t]*$', re.MULTILINE)
+# A CJK ideograph counts as one word, as does each run of Latin letters/digits
+WORD_PATTERN = re.compile(r"[\u4e00-\u9fff]|[A-Za-z0-9]+(?:['’\-][A-Za-z0-9]+)*")
+DATE_PREFIX_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2})')
+
+# Loaded indexes by path, with the (mtime_ns, size) of the file they came from
+_indexes = {}
+_index_versions = {}
+_lock = threading.Lock()
+
+def split_front_matter(text):
+    """Split a Markdown file into (front matter dict, body)"""
+    if not text.startswith('---'):
+        return {}, text
+    end = text.find('\n---', 3)
+    if end == -1:
+        return {}, text
+    # Imported here so commands that never parse front matter don't pay for yaml
+    import yaml
+    # The C loader is much faster when libyaml is available
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    try:
+        front_matter = yaml.load(text[3:end], Loader=loader) or {}
+    except yaml.YAMLError:
+        front_matter = {}
+    if not isinstance(front_matter, dict):
+        front_matter = {}
+    # Skip the closing "---" line
+    body_start = text.find('\n', end + 4)
+    return front_matter, text[body_start + 1:] if body_start != -1 else ''
+
+def count_words(text):
+    """Word count that treats each Chinese character as a word"""
+    return len(WORD_PATTERN.findall(text))
+
+def _json_safe(value):
+    """Make YAML values (dates, nested structures) storable as JSON"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {str(key): _json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(item) for item in value]
+    return value
+
+def _preview(text):
+    text = " ".join(text.split())
+    return text[:PREVIEW_LENGTH] + "..." if len(text) > PREVIEW_LENGTH else text
+
+def parse_sections(body):
+    """Split a digest body into its "## HH:MM" sections"""
+    sections = []
+    matches = list(SECTION_PATTERN.finditer(body))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(body)
+        section_text = body[match.end():end].strip()
+        sections.append({
+            "time": match.group(1),
+            "words": count_words(section_text),
+            "preview": _preview(section_text),
+        })
+    return sections
+
+def entry_date(path, front_matter):
+    """The day a file belongs to: its filename date, else its front matter date"""
+    match = DATE_PREFIX_PATTERN.match(os.path.basename(path))
+    if match:
+        return match.group(1)
+    value = front_matter.get('date')
+    if value:
+        match = DATE_PREFIX_PATTERN.match(str(value))
+        if match:
+            return match.group(1)
+    return None
+
+def build_entry(path, data, stat):
+    """Index one file from its raw bytes"""
+    text = data.decode('utf-8', errors='replace')
+    front_matter, body = split_front_matter(text)
+    front_matter = _json_safe(front_matter)
+    return {
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "title": str(front_matter.get('title', os.path.splitext(os.path.basename(path))[0])),
+        "date": entry_date(path, front_matter),
+        "front_matter": front_matter,
+        "words": count_words(body),
+        "sections": parse_sections(body),
+    }
+
+def scan_tree(roots=CONTENT_DIRS):
+    """Stat every Markdown file under the content roots"""
+    found = {}
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                if name.endswith('.md') and name != '_index.md':
+                    path = os.path.join(dirpath, name).replace(os.sep, '/')
+                    try:
+                        found[path] = os.stat(path)
+                    except OSError:
+                        continue
+    return found
+
+def load_index(index_path=INDEX_PATH):
+    """Read the stored index, or an empty one if it is missing or outdated"""
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get("version") == INDEX_VERSION:
+            return index
+    except (OSError, ValueError):
+        pass
+    return {"version": INDEX_VERSION, "files": {}}
+
+def _file_version(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def save_index(index, index_path=INDEX_PATH):
+    """Write the index atomically"""
+    atomic_write_text(index_path, json.dumps(index, ensure_ascii=False, separators=(',', ':')))
+    _index_versions[index_path] = _file_version(index_path)
+
+def _current_index(index_path):
+    """The loaded index, re-read if another process saved it since. Call with _lock held."""
+    version = _file_version(index_path)
+    if index_path not in _indexes or _index_versions.get(index_path) != version:
+        _indexes[index_path] = load_index(index_path)
+        _index_versions[index_path] = version
+    return _indexes[index_path]
+
+def _stat_paths(paths):
+    found = {}
+    for path in paths:
+        try:
+            found[path] = os.stat(path)
+        except OSError:
+            continue
+    return found
+
+def refresh(index_path=INDEX_PATH, roots=CONTENT_DIRS, paths=None):
+    """Bring the index up to date. Returns the number of files re-parsed.
+
+    With paths, only those files are checked; otherwise the whole tree is.
+    """
+    with _lock, file_lock(index_path):
+        index = _current_index(index_path)
+        files = index["files"]
+        if paths is None:
+            found = scan_tree(roots)
+            gone = set(files) - set(found)
+        else:
+            found = _stat_paths(paths)
+            gone = {path for path in paths if path in files and path not in found}
+
+        changed = False
+        parsed = 0
+        for path in gone:
+            del files[path]
+            changed = True
+
+        for path, stat in found.items():
+            entry = files.get(path)
+            if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            changed = True
+            if entry and entry["size"] == len(data) and entry["sha256"] == hashlib.sha256(data).hexdigest():
+                # Touched (e.g. by a fresh checkout) but not modified
+                entry["mtime_ns"] = stat.st_mtime_ns
+                continue
+            files[path] = build_entry(path, data, stat)
+            parsed += 1
+
+        if changed:
+            save_index(index, index_path)
+        return parsed
+
+def index_appended(path, appended_text, before_stat=None, index_path=INDEX_PATH):
+    """Update a digest's entry after sections were appended to it.
+
+    before_stat is the file's stat from before the write (None if the write
+    created it). If the entry still describes the file as it was (same size
+    and checksum; a checkout changes mtimes), the new sections are added to
+    it without re-parsing the front matter. Otherwise the file is
+    re-indexed.
+    """
+    path = path.replace(os.sep, '/')
+    if not os.path.exists(index_path):
+        # Not built on this checkout yet; the first lookup builds it in full
+        return
+    with _lock, file_lock(index_path):
+        files = _current_index(index_path)["files"]
+        with open(path, 'rb') as f:
+            data = f.read()
+        stat = os.stat(path)
+        entry = files.get(path)
+        if entry and before_stat is not None and entry["size"] == before_stat.st_size and \
+                entry["sha256"] == hashlib.sha256(data[:before_stat.st_size]).hexdigest():
+            entry.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size,
+                         sha256=hashlib.sha256(data).hexdigest(),
+                         words=entry["words"] + count_words(appended_text),
+                         sections=entry["sections"] + parse_sections(appended_text))
+        else:
+            files[path] = build_entry(path, data, stat)
+        save_index(_indexes[index_path], index_path)
+
+def get_index(index_path=INDEX_PATH, roots=CONTENT_DIRS, update=True):
+    """The in-memory index, refreshed from the tree unless update is False"""
+    if update:
+        refresh(index_path, roots)
+    with _lock:
+        return _current_index(index_path)
+
+def entries_on(date_str, index_path=INDEX_PATH, roots=CONTENT_DIRS):
+    """(path, entry) pairs for every file belonging to a day, sorted by path.
+
+    Only that day's files are checked against the disk: the ones the index
+    already dates to it, plus its digest.
+    """
+    if not os.path.exists(index_path):
+        # First use on this checkout; build the index once
+        refresh(index_path, roots)
+    files = get_index(index_path, roots, update=False)["files"]
+    candidates = {path for path, entry in files.items() if entry.get("date") == date_str}
+    candidates.update(f"{root}/{date_str}.md" for root in roots if root.endswith('daily'))
+    refresh(index_path, roots, sorted(candidates))
+
+    files = get_index(index_path, roots, update=False)["files"]
+    return sorted((path, entry) for path, entry in files.items() if entry.get("date") == date_str)
+
+def format_captures(date_str, index_path=INDEX_PATH, roots=CONTENT_DIRS):
+    """Summarize what was captured on a day, or None if nothing was"""
+    entries = entries_on(date_str, index_path, roots)
+    if not entries:
+        return None
+
+    lines = [f"📅 {date_str}"]
+    for path, entry in entries:
+        lines.append(f"\n{entry['title']} ({entry['words']} words) - {path}")
+        for section in entry["sections"]:
+            lines.append(f"  {section['time']} {section['preview']}")
+    return "\n".join(lines)
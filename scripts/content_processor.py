@@ -1,37 +1,31 @@
 # scripts/content_processor.py
 
 import os
-import re
 import json
-import yaml
+import logging
+import threading
 from datetime import datetime
-from pathlib import Path
-from utils import slugify, detect_language
+from utils import atomic_write_text, append_text, vancouver_now, file_lock
+from message_parser import parse_message
+import journal
+import queue_store
+import scheduler
+import search_index
+import content_index
+import media_store
+import metrics
+import workers
+
+logger = logging.getLogger("Content Processor")
+
+DAILY_DIR = 'content/daily'
 
 def parse_tags(text):
-    """Extract simple hashtags from text content."""
-    # Regular expression to match simple tags like #daily, #threads, #mastodon
-    tag_pattern = r'#([a-zA-Z0-9_]+)'
-    
-    tags = set()
-    matches = re.finditer(tag_pattern, text)
-    
-    for match in matches:
-        tag = match.group(1).lower()  # Extract tag without # and convert to lowercase
-        tags.add(tag)
-    
-    return tags
+    """Extract hashtags (and directive names) from text content."""
+    return parse_message(text).tags
 
-def add_to_daily_entry(content, message_id, language="zh"):
-    """Add content to the daily entry."""
-    # Get today's date for the digest file
-    today = datetime.now()
-    
-    # Convert to Vancouver time (Pacific Time)
-    import pytz
-    vancouver_tz = pytz.timezone('America/Vancouver')
-    today_vancouver = datetime.now(pytz.utc).astimezone(vancouver_tz)
-    
+def daily_digest_info(today_vancouver, language="zh"):
+    """Return (filename, title) of the digest for the given Vancouver time."""
     date_str = today_vancouver.strftime('%Y-%m-%d')
     week_num = int(today_vancouver.strftime('%W')) + 1  # Get ISO week number and add 1
     
@@ -45,183 +39,431 @@ def add_to_daily_entry(content, message_id, language="zh"):
         digest_title = f"{date_str} Week {week_num} {day_name} Digest"
     
     # Create the filename for today's digest
-    filename = f"content/daily/{date_str}.md"
-    
-    # Remove tags from the content
-    # This pattern will match hashtags and remove them
-    clean_content = re.sub(r'#[a-zA-Z0-9_]+', '', content).strip()
-    
+    filename = f"{DAILY_DIR}/{date_str}.md"
+    return filename, digest_title
+
+def render_daily_section(clean_content, today_vancouver):
+    """Render one timestamped digest section from tag-free message text."""
     # Process content to ensure proper Markdown formatting
     # Make sure paragraphs are properly separated with double line breaks
     formatted_content = clean_content.replace("\n", "\n\n").replace("\n\n\n", "\n\n").strip()
     
-    # Check if the file exists
-    if os.path.exists(filename):
-        # Load existing content
-        with open(filename, 'r', encoding='utf-8') as f:
-            existing_content = f.read()
-        
-        # Find the end of the front matter
-        front_matter_end = existing_content.find("---\n\n") + 4
-        if front_matter_end < 4:  # If the pattern wasn't found
-            front_matter_end = existing_content.find("---\n") + 4
-        
-        # Split into front matter and content
-        front_matter = existing_content[:front_matter_end]
-        digest_content = existing_content[front_matter_end:]
-        
-        # Add the new content with timestamp in Vancouver time
-        now = today_vancouver.strftime('%H:%M')
-        digest_content += f"\n## {now}\n\n{formatted_content}\n\n"
-        
-        # Write the updated file
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(front_matter)
-            f.write(digest_content)
-    
-    else:
-        # Create a new digest file
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        
-        # Prepare front matter
-        front_matter = {
-            "title": digest_title,
-            "date": today.isoformat(),
-            "type": "daily",
-            "draft": False
-        }
-        
-        # Create the initial content with this entry
-        now = today_vancouver.strftime('%H:%M')
-        content_with_time = f"## {now}\n\n{formatted_content}\n\n"
-        
-        # Write the file
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write("---\n")
-            f.write(yaml.dump(front_matter, default_flow_style=False))
-            f.write("---\n\n")
-            f.write(content_with_time)
-    
-    return {"type": "daily", "title": digest_title, "file": filename, "language": language}
-
-def add_to_platform_queue(content, platform, message_id):
-    """Add content to a specific platform queue."""
-    # Load the current queues
-    try:
-        with open('bot_data/queues.json', 'r', encoding='utf-8') as f:
-            queues = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        queues = {"threads": [], "mastodon": [], "telegram": []}
+    # Add the new content with timestamp in Vancouver time
+    now = today_vancouver.strftime('%H:%M')
+    return f"## {now}\n\n{formatted_content}\n\n"
+
+def render_front_matter(digest_title, created=None):
+    """Render the YAML front matter block for a new digest file."""
+    front_matter = {
+        "title": digest_title,
+        "date": (created or datetime.now()).isoformat(),
+        "type": "daily",
+        "draft": False
+    }
+    # Only needed when a new digest is created, so keep it off the import path
+    import yaml
+    return "---\n" + yaml.dump(front_matter, default_flow_style=False) + "---\n\n"
+
+def initial_daily_content(language="zh"):
+    """Placeholder body of a digest created before anything was captured."""
+    if language == "zh":
+        return "## 日记\n\n今天还没有记录。\n"
+    return "## Daily Digest\n\nNo entries yet.\n"
+
+@metrics.timed("daily_append")
+def write_daily_sections(filename, sections, digest_title, created=None, initial=""):
+    """Write rendered sections to a digest file in a single write.
     
-    # Ensure the platform queue exists
-    if platform not in queues:
-        queues[platform] = []
+    A new file gets front matter and the initial body before the sections.
+    The file's lock is held throughout, so another process can't create or
+    extend the same digest at the same time.
+    """
+    # Each section is separated from what precedes it by a blank line
+    appended = "".join(f"\n{section}" for section in sections)
     
-    # Remove tags from content
-    clean_content = re.sub(r'#[a-zA-Z0-9_]+', '', content).strip()
+    with file_lock(filename):
+        if os.path.exists(filename):
+            # Extend the existing digest in place; front matter is left untouched
+            before_stat = os.stat(filename)
+            append_text(filename, appended)
+        else:
+            # Create the digest atomically with front matter and these entries
+            before_stat = None
+            atomic_write_text(filename, render_front_matter(digest_title, created) + initial
+                              + (appended if initial else appended[1:]))
     
+    # Keep the search and content indexes current without rescanning
+    # content/; a failure here only means the next refresh redoes this file
+    try:
+        search_index.index_appended(filename, appended, digest_title, before_stat)
+    except Exception as e:
+        print(f"Error updating search index for {filename}: {e}")
+    try:
+        content_index.index_appended(filename, appended, before_stat)
+    except Exception as e:
+        print(f"Error updating content index for {filename}: {e}")
+
+def make_queue_post(clean_content, message_id, timestamp=None,
+                    priority=queue_store.PRIORITY_NORMAL, not_before=None):
+    """Build a queue item from tag-free message text."""
     # Prepare the post data
-    post_data = {
+    return {
         "text": clean_content,
         "message_id": str(message_id),
-        "timestamp": datetime.now().isoformat()
+        "timestamp": timestamp or datetime.now().isoformat(),
+        "priority": priority,
+        "not_before": not_before.timestamp() if not_before else None
     }
+
+def describe_schedule(platform, priority, not_before):
+    """Short label for where a post ended up, for the confirmation reply."""
+    if not_before:
+        return f"{platform}:{not_before:%m-%d %H:%M}"
+    if priority == queue_store.PRIORITY_URGENT:
+        return f"{platform}:now"
+    if priority == queue_store.PRIORITY_HIGH:
+        return f"{platform}:next"
+    return f"{platform}:queued"
+
+@metrics.timed("queue_write")
+def add_to_platform_queues(posts_by_platform, meta=None):
+    """Append posts to several platform queues in one transaction."""
+    queue_store.enqueue_many(posts_by_platform, meta=meta)
+
+def local_time(at):
+    """A journal timestamp as naive local time, the form file dates and queue items use."""
+    return datetime.fromisoformat(at).astimezone().replace(tzinfo=None)
+
+def capture_event(message, at, media, media_failed=0):
+    """The journal event recording one accepted message."""
+    return {
+        "type": "capture",
+        "at": at.isoformat(),
+        "chat_id": message.get("chat", {}).get("id"),
+        "message_id": message["message_id"],
+        # Photos and files carry their text in the caption
+        "text": message.get("text", message.get("caption", "")),
+        "media": media,
+        "media_failed": media_failed,
+    }
+
+def project_capture(event):
+    """What one capture event adds to the digests and queues.
     
-    # Add to queue
-    queues[platform].append(post_data)
+    Returns (digest, posts, result): digest is (filename, title, section)
+    or None, posts maps platform to a queue item.
+    """
+    at = datetime.fromisoformat(event["at"])
+    # Parse tags, directives, clean text and language in one pass
+    parsed = parse_message(event["text"])
+    language = parsed.language
+    media = event.get("media", [])
     
-    # Save the updated queues
-    with open('bot_data/queues.json', 'w', encoding='utf-8') as f:
-        json.dump(queues, f, indent=2)
+    # Track processing results
+    result = {"platforms": []}
+    if media or event.get("media_failed"):
+        result["media"] = len(media)
+        result["media_failed"] = event.get("media_failed", 0)
     
-    return f"{platform}:queued"
+    # If #daily tag is present or no SNS routing, add to daily entry;
+    # attachments always go to the digest, linked next to the caption
+    digest = None
+    if parsed.wants_daily or media:
+        filename, digest_title = daily_digest_info(at, language)
+        content = "\n".join(part for part in (
+            parsed.clean_text, media_store.render_media_links(media, parsed.clean_text)) if part)
+        digest = (filename, digest_title, render_daily_section(content, at))
+        result.update({"type": "daily", "title": digest_title, "file": filename, "language": language})
+    
+    # Process platform-specific tags and #SNS:: directives
+    posts = {}
+    for platform in parsed.platforms:
+        # #SNS::threads::now, #mastodon::19:30 and the like
+        timing = parsed.timing_for(platform)
+        if timing and not scheduler.is_known_timing(timing):
+            result.setdefault("unknown_timings", []).append(f"{platform}::{timing}")
+        priority, not_before = scheduler.post_schedule(timing, at)
+        posts[platform] = make_queue_post(parsed.clean_text, event["message_id"], local_time(event["at"]).isoformat(),
+                                          priority, not_before)
+        result["platforms"].append(describe_schedule(platform, priority, not_before))
+        result["type"] = result.get("type", "sns")
+    return digest, posts, result
+
+def _projection(event, projections):
+    """project_capture(event), computed once per event when projections is a dict"""
+    if projections is None:
+        return project_capture(event)
+    if event["seq"] not in projections:
+        projections[event["seq"]] = project_capture(event)
+    return projections[event["seq"]]
 
-def process_content(message):
-    """Process message content based on tags."""
-    if "text" not in message:
-        return None
+def _digest_groups(events, skip=None, projections=None):
+    """Group what events add to the digests by file, in journal order.
     
-    content = message["text"]
-    message_id = message["message_id"]
-    language = detect_language(content)
+    skip maps filename to the last seq already applied to it. Returns
+    {filename: {"title", "created", "initial", "sections", "seqs"}}.
+    """
+    groups = {}
+    for event in events:
+        if event["type"] == "create_daily":
+            filename, digest_title = daily_digest_info(datetime.fromisoformat(event["at"]), event["language"])
+            section = None
+        elif event["type"] == "capture":
+            digest = _projection(event, projections)[0]
+            if digest is None:
+                continue
+            filename, digest_title, section = digest
+        else:
+            continue
+        if skip and skip.get(filename, 0) >= event["seq"]:
+            continue
+        
+        # The first event to touch a new file decides its title
+        group = groups.get(filename)
+        if group is None:
+            group = groups[filename] = {"title": digest_title, "created": local_time(event["at"]),
+                                        "initial": "", "sections": [], "seqs": []}
+            if section is None:
+                group["initial"] = initial_daily_content(event["language"])
+        if section is not None:
+            group["sections"].append(section)
+        group["seqs"].append(event["seq"])
+    return groups
+
+@metrics.timed("materialize_digests")
+def materialize_digests(journal_path=journal.JOURNAL_PATH, projections=None):
+    """Apply the journal events the digests haven't seen yet.
+    
+    Each touched file is written once, different files in parallel, and
+    its last applied seq is checkpointed as soon as it is written, so a
+    crash later in the run doesn't append its sections again on replay.
+    If a file can't be written, the run's checkpoint stays put and the next
+    run retries only the failed file. Returns the seqs that could not be
+    applied.
+    """
+    # One materializer at a time across processes, or both would apply the
+    # same events from the same checkpoint
+    with file_lock("digests"):
+        return _materialize_digests(journal_path, projections)
+
+def _write_digest_group(filename, group):
+    """Apply one file's share of the new events"""
+    # create_daily only makes a file that doesn't exist yet
+    if group["sections"] or not os.path.exists(filename):
+        write_daily_sections(filename, group["sections"], group["title"], group["created"], group["initial"])
+
+def _materialize_digests(journal_path, projections):
+    checkpoint = journal.load_checkpoint("digests")
+    applied = checkpoint.setdefault("files", {})
+    events = []
+    end_offset = checkpoint["offset"]
+    for event, end_offset in journal.read(checkpoint["seq"], checkpoint["offset"], journal_path):
+        events.append(event)
+    if not events:
+        return set()
+    
+    failed = set()
+    saving = threading.Lock()
+    
+    def write(filename, group):
+        _write_digest_group(filename, group)
+        with saving:
+            applied[filename] = group["seqs"][-1]
+            journal.save_checkpoint("digests", checkpoint)
+    
+    # Partitioned by file: sections of one digest stay in journal order
+    groups = _digest_groups(events, applied, projections)
+    outcomes = workers.run_partitioned(groups, write, name="digests")
+    for filename, (_, error) in outcomes.items():
+        if error is not None:
+            print(f"Error writing {filename}: {error}")
+            failed.update(groups[filename]["seqs"])
+    
+    if not failed:
+        checkpoint.update(seq=events[-1]["seq"], offset=end_offset, files={})
+    journal.save_checkpoint("digests", checkpoint)
+    return failed
+
+def _queue_checkpoint():
+    """The queue materializer's checkpoint, kept in the queue database itself"""
+    value = queue_store.get_meta(journal.QUEUE_CHECKPOINT_KEY)
+    return json.loads(value) if value else {"seq": 0, "offset": 0}
+
+@metrics.timed("materialize_queues")
+def materialize_queues(journal_path=journal.JOURNAL_PATH, projections=None):
+    """Apply the journal events the SNS queues haven't seen yet.
+    
+    The posts and the checkpoint are committed in one transaction, so
+    every event is queued exactly once. Returns the seqs that could not
+    be applied.
+    """
+    with file_lock("queues"):
+        return _materialize_queues(journal_path, projections)
+
+def _materialize_queues(journal_path, projections):
+    checkpoint = _queue_checkpoint()
+    posts_by_platform = {}
+    seqs = []
+    last = None
+    for event, end_offset in journal.read(checkpoint["seq"], checkpoint["offset"], journal_path):
+        last = {"seq": event["seq"], "offset": end_offset}
+        if event["type"] != "capture":
+            continue
+        posts = _projection(event, projections)[1]
+        for platform, post in posts.items():
+            posts_by_platform.setdefault(platform, []).append(post)
+        if posts:
+            seqs.append(event["seq"])
+    if last is None:
+        return set()
     
     try:
-        # Parse the tags in the message
-        tags = parse_tags(content)
-        
-        # Track processing results
-        results = {"platforms": []}
-        
-        # Process based on tags
-        # If #daily tag is present or no recognized tags, add to daily entry
-        if 'daily' in tags or not any(tag in tags for tag in ['threads', 'mastodon']):
-            daily_result = add_to_daily_entry(content, message_id, language)
-            results.update(daily_result)
-        
-        # Process platform-specific tags
-        if 'threads' in tags:
-            result = add_to_platform_queue(content, "threads", message_id)
-            results["platforms"].append(result)
-            results["type"] = results.get("type", "sns")
-        
-        if 'mastodon' in tags:
-            result = add_to_platform_queue(content, "mastodon", message_id)
-            results["platforms"].append(result)
-            results["type"] = results.get("type", "sns")
-        
-        return results
+        add_to_platform_queues(posts_by_platform, meta={journal.QUEUE_CHECKPOINT_KEY: json.dumps(last)})
     except Exception as e:
-        print(f"Error processing content: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+        print(f"Error saving queues: {e}")
+        return set(seqs)
+    return set()
+
+def materialize(journal_path=journal.JOURNAL_PATH, projections=None):
+    """Bring the digests and queues up to date with the journal. Returns the seqs that failed."""
+    if projections is None:
+        projections = {}
+    return materialize_digests(journal_path, projections) | materialize_queues(journal_path, projections)
+
+@metrics.timed("process_contents")
+def process_contents(messages):
+    """Process a batch of messages based on tags.
+    
+    Attachments are downloaded, then every message with something to
+    record is appended to the journal in one write. The digests and queues
+    are then brought up to date from the journal, each digest file and the
+    queue database written once for the whole batch. Returns one result
+    per message: what it added, {"type": "pending"} if it was journaled
+    but couldn't be applied yet, or None.
+    """
+    results = [None] * len(messages)
+    today_vancouver = vancouver_now()
+    
+    # Download every attachment in the batch up front, concurrently
+    media_by_message = [media_store.media_items(message) for message in messages]
+    saved_media = media_store.save_media(
+        [item for items in media_by_message for item in items], today_vancouver)
+    
+    events = []
+    indexes = []
+    for index, message in enumerate(messages):
+        media_items = media_by_message[index]
+        if "text" not in message and not media_items:
+            continue
+        media = [saved_media[item["file_unique_id"]] for item in media_items
+                 if item["file_unique_id"] in saved_media]
+        event = capture_event(message, today_vancouver, media, len(media_items) - len(media))
+        if media_items and not media and not parse_message(event["text"]).clean_text:
+            # Nothing left to record
+            continue
+        events.append(event)
+        indexes.append(index)
+    
+    # Once journaled a message is safe: anything below that fails is
+    # replayed from the journal on the next run
+    events = journal.append(events)
+    projections = {}
+    failed = materialize(projections=projections)
+    
+    for index, event in zip(indexes, events):
+        if event["seq"] in failed:
+            # Journaled, so the next run's replay applies it
+            results[index] = {"type": "pending", "seq": event["seq"]}
+            continue
+        try:
+            results[index] = _projection(event, projections)[2]
+        except Exception as e:
+            logger.error(f"Error processing content: {e}", exc_info=True)
+    
+    return results
 
 def create_daily_entry(language="zh"):
     """Create today's digest if it doesn't exist already."""
-    # Get today's date info
-    today = datetime.now()
+    # Get today's date info in Vancouver time
+    today_vancouver = vancouver_now()
+    filename, _ = daily_digest_info(today_vancouver, language)
     
-    # Convert to Vancouver time
-    import pytz
-    vancouver_tz = pytz.timezone('America/Vancouver')
-    today_vancouver = datetime.now(pytz.utc).astimezone(vancouver_tz)
+    # Only create if it doesn't exist
+    if os.path.exists(filename):
+        return {"created": False, "language": language}
     
-    date_str = today_vancouver.strftime('%Y-%m-%d')
-    week_num = int(today_vancouver.strftime('%W')) + 1
+    journal.append([{"type": "create_daily", "at": today_vancouver.isoformat(), "language": language}])
+    materialize_digests()
+    return {"created": os.path.exists(filename), "file": filename, "language": language}
+
+def _unjournaled_text(path, group):
+    """What an existing digest holds beyond the journal's events for it"""
+    with open(path, 'r', encoding='utf-8') as f:
+        _, body = content_index.split_front_matter(f.read())
+    # An unedited placeholder is no loss, whichever language it is in
+    known = [group["initial"], initial_daily_content("zh"), initial_daily_content("en")] + group["sections"]
+    for text in known:
+        text = text.strip()
+        if text:
+            body = body.replace(text, "", 1)
+    return body.strip()
+
+def rebuild_digests(output_dir=DAILY_DIR, journal_path=journal.JOURNAL_PATH):
+    """Rewrite every digest the journal knows about, from scratch.
     
-    # Set language-specific parameters
-    if language == "zh":
-        day_names = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"]
-        day_name = day_names[today_vancouver.weekday()]
-        digest_title = f"{date_str} 第{week_num}周 {day_name}"
-        initial_content = "## 日记\n\n今天还没有记录。\n"
-    else:
-        day_name = today_vancouver.strftime('%A')
-        digest_title = f"{date_str} Week {week_num} {day_name} Digest"
-        initial_content = "## Daily Digest\n\nNo entries yet.\n"
+    Pending events are materialized first, then one streaming pass over the
+    journal writes each digest once. Digests with no journal events are
+    left alone, and so is any existing
+    digest holding text the journal doesn't account for (entries from
+    before the journal, hand edits). Returns (files written, files skipped).
+    """
+    last = {"seq": 0, "offset": 0, "files": {}}
     
-    # Create the filename for today's digest
-    filename = f"content/daily/{date_str}.md"
+    def events():
+        for event, end_offset in journal.read(0, 0, journal_path):
+            last.update(seq=event["seq"], offset=end_offset)
+            yield event
     
-    # Only create if it doesn't exist
-    if not os.path.exists(filename):
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        
-        # Prepare front matter
-        front_matter = {
-            "title": digest_title,
-            "date": datetime.now().isoformat(),
-            "type": "daily",
-            "draft": False
-        }
-        
-        # Write the file
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write("---\n")
-            f.write(yaml.dump(front_matter, default_flow_style=False))
-            f.write("---\n\n")
-            f.write(initial_content)
-        
-        return {"created": True, "file": filename, "language": language}
+    def write(filename, group):
+        body = group["initial"] + "".join(f"\n{section}" for section in group["sections"])
+        if not group["initial"]:
+            body = body[1:]
+        target = os.path.join(output_dir, os.path.basename(filename))
+        with file_lock(target):
+            if os.path.exists(target) and _unjournaled_text(target, group):
+                return False
+            atomic_write_text(target, render_front_matter(group["title"], group["created"]) + body)
+        return True
     
-    return {"created": False, "language": language}
+    live = os.path.abspath(output_dir) == os.path.abspath(DAILY_DIR)
+    # Holding the materializer's lock keeps live appends out of the files being replaced
+    with file_lock("digests"):
+        # A skipped digest keeps its own text, so first give every live digest
+        # the journal events it hasn't seen yet
+        unapplied = _materialize_digests(journal_path, None) if live else set()
+        groups = _digest_groups(events())
+        skipped = []
+        for filename, (written, error) in workers.run_partitioned(groups, write, name="rebuild").items():
+            if error is not None:
+                raise error
+            if not written:
+                print(f"Not rebuilding {filename}: it has entries the journal doesn't know about")
+                skipped.append(filename)
+        
+        # The rebuilt digests are now exactly the journal's projection; the
+        # skipped ones keep what they have and are reported for a manual look
+        if live:
+            if unapplied:
+                # A skipped digest may still be missing events, so only the
+                # rebuilt ones are marked as complete
+                checkpoint = journal.load_checkpoint("digests")
+                applied = checkpoint.setdefault("files", {})
+                for filename, group in groups.items():
+                    if filename not in skipped:
+                        applied[filename] = group["seqs"][-1]
+                journal.save_checkpoint("digests", checkpoint)
+            else:
+                journal.save_checkpoint("digests", last)
+            if os.path.exists(content_index.INDEX_PATH):
+                content_index.refresh(paths=sorted(set(groups) - set(skipped)))
+    return len(groups) - len(skipped), skipped
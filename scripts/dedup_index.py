@@ -0,0 +1,135 @@
+# scripts/dedup_index.py
+"""
+Index of messages that have already been handled.
+
+Telegram delivers updates at least once: if a run dies before it saves
+last_update_id, the next run gets the same updates again. Every handled
+(chat_id, message_id) pair is recorded in bot_data/dedup.db and checked
+before anything else happens to a message, so a redelivered message is
+skipped instead of being appended and queued a second time.
+
+Captured messages are recorded from the journal: catch_up() reads the
+events appended since its checkpoint and stores their keys together with
+the new checkpoint in one transaction, so a crash right after journaling
+can't leave a message journaled but not marked. Entries expire after
+DEDUP_TTL_SECONDS, long after Telegram stops redelivering an update.
+"""
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+
+import journal
+
+DEDUP_DB_PATH = 'bot_data/dedup.db'
+# Telegram keeps unconfirmed updates for 24 hours; keep keys for a week
+DEDUP_TTL_SECONDS = 7 * 24 * 3600
+# Expired keys are deleted at most this often per process
+PRUNE_INTERVAL_SECONDS = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS handled (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    handled_at REAL NOT NULL,
+    PRIMARY KEY (chat_id, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_handled_at ON handled (handled_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# One connection per database path, shared by threads like queue_store's
+_connections = {}
+_lock = threading.RLock()
+_last_prune = {}
+
+def message_key(message):
+    """The (chat_id, message_id) pair identifying a message"""
+    return message.get("chat", {}).get("id") or 0, message["message_id"]
+
+def get_connection(db_path=DEDUP_DB_PATH):
+    """Open (or reuse) the dedup database"""
+    with _lock:
+        conn = _connections.get(db_path)
+        if conn is None:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            _connections[db_path] = conn
+    return conn
+
+def close_connections():
+    """Checkpoint the WAL and close every open connection"""
+    with _lock:
+        for db_path, conn in list(_connections.items()):
+            try:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                conn.close()
+                del _connections[db_path]
+
+# Fold the WAL back into dedup.db before the workflow commits bot_data/
+atexit.register(close_connections)
+
+def handled(keys, db_path=DEDUP_DB_PATH):
+    """The subset of (chat_id, message_id) keys that were handled before"""
+    keys = list(keys)
+    if not keys:
+        return set()
+    conn = get_connection(db_path)
+    found = set()
+    with _lock:
+        for key in keys:
+            if conn.execute("SELECT 1 FROM handled WHERE chat_id = ? AND message_id = ?", key).fetchone():
+                found.add(key)
+    return found
+
+def mark(keys, db_path=DEDUP_DB_PATH, now=None, meta=None):
+    """Record keys as handled. meta ({key: value}) is stored in the same transaction."""
+    now = time.time() if now is None else now
+    conn = get_connection(db_path)
+    with _lock, conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("INSERT OR REPLACE INTO handled (chat_id, message_id, handled_at) VALUES (?, ?, ?)",
+                         [(chat_id, message_id, now) for chat_id, message_id in keys])
+        if meta:
+            conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta.items())
+    prune(db_path, now)
+
+def catch_up(db_path=DEDUP_DB_PATH, journal_path=journal.JOURNAL_PATH):
+    """Mark every message journaled since the last call. Returns how many were marked."""
+    conn = get_connection(db_path)
+    with _lock:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'journal_checkpoint'").fetchone()
+    checkpoint = json.loads(row[0]) if row else {"seq": 0, "offset": 0}
+
+    keys = []
+    last = None
+    for event, end_offset in journal.read(checkpoint["seq"], checkpoint["offset"], journal_path):
+        last = {"seq": event["seq"], "offset": end_offset}
+        if event["type"] == "capture":
+            keys.append((event.get("chat_id") or 0, event["message_id"]))
+    if last is None:
+        return 0
+    mark(keys, db_path, meta={"journal_checkpoint": json.dumps(last)})
+    return len(keys)
+
+def prune(db_path=DEDUP_DB_PATH, now=None, force=False):
+    """Forget keys older than DEDUP_TTL_SECONDS. Returns how many were removed."""
+    now = time.time() if now is None else now
+    if not force and now - _last_prune.get(db_path, 0) < PRUNE_INTERVAL_SECONDS:
+        return 0
+    _last_prune[db_path] = now
+    conn = get_connection(db_path)
+    with _lock, conn:
+        cursor = conn.execute("DELETE FROM handled WHERE handled_at < ?", (now - DEDUP_TTL_SECONDS,))
+    return cursor.rowcount
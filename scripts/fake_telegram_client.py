@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# scripts/fake_telegram_client.py
+"""
+Stand-in for Telegram when testing the webhook receiver locally.
+
+Posts canned update JSON to a running `telegram_handler.py --action webhook`:
+
+    AUTHORIZED_USER_ID=1 python scripts/telegram_handler.py --action webhook --port 8443
+    python scripts/fake_telegram_client.py --url http://127.0.0.1:8443/telegram/webhook --user-id 1
+"""
+import sys
+import json
+import time
+import argparse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+SAMPLE_TEXTS = [
+    "学校在自习位置上也放了光疗灯，看来温哥华雨季的阴天真的很难熬。 #daily",
+    "another test post without tags",
+    "Trying out the new capture flow #threads #mastodon",
+    "上周坚持了几天的早睡早起，这周全崩了。 #daily #threads",
+    "!queues",
+]
+
+def make_update(update_id, text, user_id, chat_id=None, message_id=None):
+    """Build a Telegram update dict shaped like a private-chat text message"""
+    chat_id = chat_id if chat_id is not None else user_id
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": message_id if message_id is not None else update_id,
+            "from": {"id": user_id, "is_bot": False, "first_name": "Flow"},
+            "chat": {"id": chat_id, "type": "private"},
+            "date": int(time.time()),
+            "text": text,
+        },
+    }
+
+def post_update(url, update, secret=None):
+    """POST one update to the webhook URL. Returns the HTTP status code."""
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    request = urllib.request.Request(
+        url, data=json.dumps(update).encode('utf-8'), headers=headers, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def post_updates(url, updates, secret=None, concurrency=8):
+    """POST a burst of updates concurrently, like Telegram delivering forwards"""
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda update: post_update(url, update, secret), updates))
+
+def main():
+    parser = argparse.ArgumentParser(description='Send canned Telegram updates to a webhook')
+    parser.add_argument('--url', default='http://127.0.0.1:8443/telegram/webhook')
+    parser.add_argument('--user-id', type=int, required=True, help='Sender ID (use AUTHORIZED_USER_ID)')
+    parser.add_argument('--secret', help='Value for X-Telegram-Bot-Api-Secret-Token')
+    parser.add_argument('--file', help='JSON file with a list of updates to send instead of the samples')
+    parser.add_argument('--start-id', type=int, default=int(time.time()),
+                        help='First update_id for generated samples')
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, 'r', encoding='utf-8') as f:
+            updates = json.load(f)
+    else:
+        updates = [make_update(args.start_id + i, text, args.user_id)
+                   for i, text in enumerate(SAMPLE_TEXTS)]
+
+    statuses = post_updates(args.url, updates, args.secret)
+    for update, status in zip(updates, statuses):
+        print(f"update {update['update_id']}: HTTP {status}")
+    return 0 if all(status == 200 for status in statuses) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
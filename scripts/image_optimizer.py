@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# scripts/image_optimizer.py
+"""
+Resize and re-encode site images before the Hugo build.
+
+Finds the images Hugo serves from static/ (post images themselves live on
+the image host) and writes WebP and JPEG variants at a few widths to
+static/img/. Variant names are derived from the source's content hash, so
+an image used under two names is only encoded once. The manifest is
+data/images.json, keyed by each image's site path; the Markdown image
+render hook (layouts/_default/_markup/render-image.html) reads it as
+site.Data.images to emit <picture> elements with these srcsets:
+
+    sources: {"images/avatar.jpg": "<sha256>", ...}
+    images:  {"<sha256>": {"width", "height", "bytes", "variants",
+                           "srcset": {"webp": "...", "jpeg": "..."}}}
+
+Sources whose mtime and size match the manifest aren't even re-hashed, and
+hashes already in the manifest aren't re-encoded, so reruns only touch new
+images. Encoding runs in a process pool. Needs Pillow:
+
+    pip install Pillow
+    python scripts/image_optimizer.py
+"""
+import os
+import sys
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import load_json_file, save_json_file
+
+IMAGE_MANIFEST_PATH = 'data/images.json'
+OUTPUT_DIR = 'static/img'
+OUTPUT_URL = '/img'
+SOURCE_ROOTS = ('static',)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.gif')
+WIDTHS = (480, 960, 1600)
+QUALITY = {"webp": 80, "jpeg": 82}
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def find_images(roots=SOURCE_ROOTS, output_dir=OUTPUT_DIR):
+    """Stat every image under the roots, except the variants in output_dir"""
+    found = {}
+    skip = os.path.abspath(output_dir)
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [name for name in dirnames
+                           if os.path.abspath(os.path.join(dirpath, name)) != skip]
+            for name in filenames:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(dirpath, name).replace(os.sep, '/')
+                    found[path] = os.stat(path)
+    return found
+
+def source_key(path):
+    """Manifest key for a source: its path on the site, relative to static/"""
+    return path[len('static/'):] if path.startswith('static/') else path
+
+def folder_name(key):
+    """The site folder an image is served from, for the size report"""
+    return os.path.dirname(key) or '/'
+
+def file_digest(path):
+    """sha256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def encode_variants(path, digest, output_dir=OUTPUT_DIR, widths=WIDTHS):
+    """Write every variant of one image. Runs in a worker process."""
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        original_width, original_height = image.size
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        # Never upscale; an image narrower than every target gets one variant at its own width
+        targets = sorted({min(width, original_width) for width in widths})
+        os.makedirs(output_dir, exist_ok=True)
+        variants = []
+        for width in targets:
+            height = max(1, round(original_height * width / original_width))
+            resized = image if width == original_width else image.resize((width, height), Image.LANCZOS)
+            for fmt, extension in (("webp", "webp"), ("jpeg", "jpg")):
+                frame = resized
+                if fmt == "jpeg" and has_alpha:
+                    # JPEG has no alpha channel; flatten onto white
+                    frame = Image.new('RGB', resized.size, (255, 255, 255))
+                    frame.paste(resized, mask=resized.getchannel('A'))
+                name = f"{digest[:16]}-{width}.{extension}"
+                target = os.path.join(output_dir, name)
+                tmp_path = target + '.tmp'
+                frame.save(tmp_path, format=fmt.upper(), quality=QUALITY[fmt], optimize=True,
+                           **({"method": 6} if fmt == "webp" else {"progressive": True}))
+                os.replace(tmp_path, target)
+                variants.append({"format": fmt, "width": width, "height": height,
+                                 "file": name, "bytes": os.path.getsize(target)})
+
+    return {"width": original_width, "height": original_height, "variants": variants}
+
+def build_srcset(variants, url_prefix=OUTPUT_URL):
+    """srcset strings per format, narrowest first"""
+    srcset = {}
+    for variant in sorted(variants, key=lambda v: v["width"]):
+        srcset.setdefault(variant["format"], []).append(f"{url_prefix}/{variant['file']} {variant['width']}w")
+    return {fmt: ", ".join(entries) for fmt, entries in srcset.items()}
+
+def _variants_exist(entry, output_dir):
+    return all(os.path.exists(os.path.join(output_dir, variant["file"])) for variant in entry["variants"])
+
+def optimize_images(roots=SOURCE_ROOTS, manifest_path=IMAGE_MANIFEST_PATH,
+                    output_dir=OUTPUT_DIR, workers=None):
+    """Encode new images and update the manifest. Returns {folder: (original bytes, optimized bytes)}."""
+    manifest = load_json_file(manifest_path, default={})
+    sources = manifest.setdefault("sources", {})
+    images = manifest.setdefault("images", {})
+    stats = manifest.setdefault("stats", {})
+
+    found = find_images(roots, output_dir)
+    current = {}
+    pending = {}
+    for path, stat in found.items():
+        key = source_key(path)
+        known = stats.get(key)
+        digest = None
+        if known and known["mtime_ns"] == stat.st_mtime_ns and known["size"] == stat.st_size:
+            digest = sources.get(key)
+        if digest is None:
+            digest = file_digest(path)
+            stats[key] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+        current[key] = digest
+        entry = images.get(digest)
+        if not entry or not _variants_exist(entry, output_dir):
+            pending.setdefault(digest, (path, stat.st_size))
+
+    if pending:
+        print(f"Encoding {len(pending)} new images")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {digest: executor.submit(encode_variants, path, digest, output_dir)
+                       for digest, (path, _) in pending.items()}
+            for digest, future in futures.items():
+                path, size = pending[digest]
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    print(f"Error optimizing {path}: {e}")
+                    continue
+                entry["bytes"] = size
+                entry["srcset"] = build_srcset(entry["variants"])
+                images[digest] = entry
+
+    # Forget sources that were removed, and images no source uses any more
+    for key in set(stats) - set(current):
+        del stats[key]
+    manifest["sources"] = {key: digest for key, digest in current.items() if digest in images}
+    used = set(manifest["sources"].values())
+    for digest in set(images) - used:
+        del images[digest]
+
+    save_json_file(manifest_path, manifest)
+    return bytes_by_folder(manifest)
+
+def bytes_by_folder(manifest):
+    """Original bytes vs. the widest WebP variant each folder now serves"""
+    totals = {}
+    for key, digest in manifest["sources"].items():
+        entry = manifest["images"][digest]
+        webp = [variant for variant in entry["variants"] if variant["format"] == "webp"]
+        served = max(webp, key=lambda v: v["width"])["bytes"] if webp else entry["bytes"]
+        original, optimized = totals.get(folder_name(key), (0, 0))
+        totals[folder_name(key)] = (original + entry["bytes"], optimized + served)
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description='Resize and re-encode site images for the Hugo build')
+    parser.add_argument('--manifest', default=IMAGE_MANIFEST_PATH, help='Manifest JSON path')
+    parser.add_argument('--output', default=OUTPUT_DIR, help='Directory for the encoded variants')
+    parser.add_argument('--workers', type=int, help='Encoder processes (default: CPU count)')
+    args = parser.parse_args()
+
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        print("Pillow is not installed; run `pip install Pillow` to optimize images")
+        return 1
+
+    totals = optimize_images(manifest_path=args.manifest, output_dir=args.output, workers=args.workers)
+    for folder, (original, optimized) in sorted(totals.items()):
+        saved = original - optimized
+        print(f"{folder}: {original / 1024:.0f} KB -> {optimized / 1024:.0f} KB "
+              f"(saved {saved / 1024:.0f} KB, {saved / original * 100 if original else 0:.0f}%)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
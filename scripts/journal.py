@@ -0,0 +1,158 @@
+# scripts/journal.py
+"""
+Append-only journal of captured messages.
+
+Every accepted message is recorded once, as one JSON line in
+bot_data/journal.jsonl, before anything else happens to it:
+
+    {"seq": 42, "type": "capture", "at": "2025-03-12T07:48:10-07:00",
+     "chat_id": 1, "message_id": 7, "text": "...", "media": [...], "media_failed": 0}
+
+A batch of events is written with a single write and a single fsync. The
+daily digests and the SNS queues are projections of the journal, kept up to
+date by materializers in content_processor. Each materializer checkpoints
+the sequence number and byte offset of the last event it applied, so it only
+reads what was appended since, and a crash between the append and the
+projection is repaired by replaying from the checkpoint.
+
+Appends and materializer runs hold fcntl locks (utils.file_lock), so
+overlapping runs never hand out the same sequence number or apply an
+event twice.
+"""
+import os
+import json
+import threading
+
+from utils import load_json_file, save_json_file, file_lock
+
+JOURNAL_PATH = 'bot_data/journal.jsonl'
+CHECKPOINTS_PATH = 'bot_data/journal_checkpoints.json'
+# The queue materializer keeps its checkpoint in the queue database, under this meta key
+QUEUE_CHECKPOINT_KEY = 'journal_checkpoint'
+# Read backwards in blocks of this size to find the last event
+TAIL_BLOCK_SIZE = 64 * 1024
+
+# (file size, last sequence number) as of our last look, by journal path;
+# a different size means another process appended since
+_last_seqs = {}
+_lock = threading.Lock()
+
+def _parse_line(line):
+    """An event from one raw journal line, or None for a torn or corrupt line"""
+    try:
+        event = json.loads(line)
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return event if isinstance(event, dict) and "seq" in event else None
+
+def _read_last_seq(path):
+    """Sequence number of the last complete event in the file, 0 if there is none"""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return 0
+    with f:
+        end = f.seek(0, os.SEEK_END)
+        tail = b''
+        while end > 0:
+            start = max(0, end - TAIL_BLOCK_SIZE)
+            f.seek(start)
+            tail = f.read(end - start) + tail
+            end = start
+            lines = tail.split(b'\n')
+            # lines[0] may be cut off by the block boundary unless we reached the start
+            for line in reversed(lines if start == 0 else lines[1:]):
+                event = _parse_line(line) if line.strip() else None
+                if event is not None:
+                    return event["seq"]
+            tail = lines[0]
+    return 0
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+def _cached_last_seq(path):
+    """last_seq() without taking _lock"""
+    size = _file_size(path)
+    cached = _last_seqs.get(path)
+    if cached is None or cached[0] != size:
+        cached = _last_seqs[path] = (size, _read_last_seq(path))
+    return cached[1]
+
+def last_seq(path=JOURNAL_PATH):
+    """Sequence number of the newest event in the journal"""
+    with _lock:
+        return _cached_last_seq(path)
+
+def append(events, path=JOURNAL_PATH):
+    """Number events and append them durably. Returns the events with "seq" set."""
+    if not events:
+        return []
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    with _lock, file_lock(path):
+        seq = _cached_last_seq(path)
+        numbered = []
+        for event in events:
+            seq += 1
+            numbered.append({"seq": seq, **event})
+        data = "".join(json.dumps(event, ensure_ascii=False, separators=(',', ':')) + "\n"
+                       for event in numbered).encode('utf-8')
+
+        with open(path, 'a+b') as f:
+            # A crash mid-write can leave a torn last line; start on a fresh one
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    data = b'\n' + data
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            _last_seqs[path] = (f.tell(), seq)
+    return numbered
+
+def read(after_seq=0, offset=0, path=JOURNAL_PATH):
+    """Yield (event, end offset) for every event after after_seq.
+
+    offset is where to start reading, normally the end offset checkpointed
+    with after_seq; reading starts over from the top if the file is shorter.
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        position = offset if 0 <= offset <= size else 0
+        f.seek(position)
+        for line in f:
+            position += len(line)
+            if not line.endswith(b'\n'):
+                # Still being written, or torn by a crash
+                break
+            event = _parse_line(line)
+            if event is None:
+                if line.strip():
+                    print(f"Skipping unreadable journal line ending at byte {position}")
+                continue
+            if event["seq"] > after_seq:
+                yield event, position
+
+def load_checkpoint(name, path=CHECKPOINTS_PATH):
+    """A materializer's checkpoint: {"seq": ..., "offset": ...} plus its own fields"""
+    checkpoint = load_json_file(path).get(name, {})
+    checkpoint.setdefault("seq", 0)
+    checkpoint.setdefault("offset", 0)
+    return checkpoint
+
+def save_checkpoint(name, checkpoint, path=CHECKPOINTS_PATH):
+    """Record how far a materializer has got"""
+    with _lock:
+        checkpoints = load_json_file(path)
+        checkpoints[name] = checkpoint
+        return save_json_file(path, checkpoints)
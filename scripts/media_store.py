@@ -0,0 +1,170 @@
+# scripts/media_store.py
+"""
+Download photos and files sent to the bot.
+
+Each attachment's file_id is resolved with getFile and the file is streamed
+to static/media/YYYY/MM/ in chunks, so large files never sit in memory.
+bot_data/media_index.json maps Telegram's file_unique_id to the saved
+file, so the same photo forwarded twice is only downloaded once, even by
+two processes at the same time (serve or webhook and the cron run). A batch of
+attachments downloads concurrently over the shared HTTP session with a
+bounded number of workers.
+"""
+import os
+import mimetypes
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from utils import request_with_retry, load_json_file, save_json_file, file_lock, TELEGRAM_API_BASE
+
+MEDIA_DIR = 'static/media'
+MEDIA_URL = '/media'
+MEDIA_INDEX_PATH = 'bot_data/media_index.json'
+MAX_DOWNLOAD_WORKERS = 4
+CHUNK_SIZE = 64 * 1024
+# getFile only serves files up to 20 MB
+MAX_FILE_SIZE = 20 * 1024 * 1024
+DOWNLOAD_TIMEOUT = (5, 60)
+
+# Message fields that carry a single attachment
+MEDIA_KINDS = ("document", "video", "audio", "voice", "animation", "video_note")
+
+def media_items(message):
+    """The attachments in a message, as plain dicts"""
+    items = []
+    if message.get("photo"):
+        # Telegram lists every size it generated; the last is the largest
+        photo = message["photo"][-1]
+        items.append({"kind": "photo", "file_id": photo["file_id"],
+                      "file_unique_id": photo["file_unique_id"], "file_size": photo.get("file_size"),
+                      "file_name": None, "mime_type": "image/jpeg"})
+    for kind in MEDIA_KINDS:
+        attachment = message.get(kind)
+        if attachment:
+            items.append({"kind": kind, "file_id": attachment["file_id"],
+                          "file_unique_id": attachment["file_unique_id"],
+                          "file_size": attachment.get("file_size"),
+                          "file_name": attachment.get("file_name"),
+                          "mime_type": attachment.get("mime_type")})
+    return items
+
+def get_file_path(file_id):
+    """Resolve a file_id to the path getFile hands out for downloading"""
+    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
+    url = f"{TELEGRAM_API_BASE}/bot{bot_token}/getFile"
+    response = request_with_retry('GET', url, params={"file_id": file_id}, timeout=30)
+    data = response.json()
+    if not data.get("ok"):
+        raise RuntimeError(f"getFile failed: {data.get('description', response.status_code)}")
+    return data["result"]["file_path"]
+
+def _extension(item, file_path):
+    """File extension from the original name, Telegram's path or the MIME type"""
+    for name in (item.get("file_name"), file_path):
+        if name:
+            extension = os.path.splitext(name)[1].lower()
+            if extension:
+                return extension
+    return mimetypes.guess_extension(item.get("mime_type") or "") or ".bin"
+
+def download_file(file_path, target):
+    """Stream a Telegram file to target in chunks. Returns the bytes written."""
+    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
+    url = f"{TELEGRAM_API_BASE}/file/bot{bot_token}/{file_path}"
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = target + '.part'
+    written = 0
+    response = request_with_retry('GET', url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+    try:
+        response.raise_for_status()
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                written += len(chunk)
+                if written > MAX_FILE_SIZE:
+                    raise ValueError(f"{file_path} is larger than {MAX_FILE_SIZE} bytes")
+                f.write(chunk)
+        os.replace(tmp_path, target)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    finally:
+        response.close()
+    return written
+
+def save_item(item, now=None):
+    """Download one attachment unless it is already in the index. Returns its index entry."""
+    # Whoever gets the attachment's lock second finds it in the index
+    with file_lock(f"media-{item['file_unique_id']}"):
+        return _save_item(item, now)
+
+def _save_item(item, now):
+    with file_lock(MEDIA_INDEX_PATH):
+        known = load_json_file(MEDIA_INDEX_PATH).get(item["file_unique_id"])
+    if known and os.path.exists(known["path"]):
+        return known
+
+    if item.get("file_size") and item["file_size"] > MAX_FILE_SIZE:
+        raise ValueError(f"{item['kind']} is larger than {MAX_FILE_SIZE} bytes")
+
+    now = now or datetime.now()
+    file_path = get_file_path(item["file_id"])
+    name = f"{item['file_unique_id']}{_extension(item, file_path)}"
+    relative = f"{now:%Y/%m}/{name}"
+    target = os.path.join(MEDIA_DIR, relative)
+    size = download_file(file_path, target)
+
+    entry = {
+        "kind": item["kind"],
+        "path": target,
+        "url": f"{MEDIA_URL}/{relative}",
+        "file_name": item.get("file_name"),
+        "mime_type": item.get("mime_type"),
+        "size": size,
+        "saved_at": now.isoformat(),
+    }
+    with file_lock(MEDIA_INDEX_PATH):
+        index = load_json_file(MEDIA_INDEX_PATH)
+        index[item["file_unique_id"]] = entry
+        save_json_file(MEDIA_INDEX_PATH, index)
+    return entry
+
+@metrics.timed("media_download")
+def save_media(items, now=None, max_workers=MAX_DOWNLOAD_WORKERS):
+    """Download a batch of attachments concurrently.
+
+    Returns {file_unique_id: entry}; attachments that failed are left out.
+    """
+    unique = {}
+    for item in items:
+        unique.setdefault(item["file_unique_id"], item)
+    if not unique:
+        return {}
+
+    saved = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique)),
+                            thread_name_prefix="media") as executor:
+        futures = {key: executor.submit(save_item, item, now) for key, item in unique.items()}
+        for key, future in futures.items():
+            try:
+                saved[key] = future.result()
+            except Exception as e:
+                print(f"Error downloading {unique[key]['kind']} {key}: {e}")
+    return saved
+
+def render_media_links(entries, caption=""):
+    """Markdown for attachments: images inline, everything else as a link"""
+    lines = []
+    for entry in entries:
+        if entry["kind"] == "photo" or (entry.get("mime_type") or "").startswith("image/"):
+            alt = " ".join(caption.split())[:40].replace("[", "").replace("]", "")
+            lines.append(f"![{alt}]({entry['url']})")
+        else:
+            label = entry.get("file_name") or f"{entry['kind']} ({entry['size'] // 1024} KB)"
+            # A bracket in a file name would end the link text early
+            label = label.replace("[", "\\[").replace("]", "\\]")
+            lines.append(f"[📎 {label}]({entry['url']})")
+    return "\n".join(lines)
@@ -0,0 +1,124 @@
+# scripts/message_parser.py
+"""
+Single-pass parser for captured messages.
+
+One compiled regex walks the text once and picks out hashtags, routing
+directives and runs of Chinese characters. Everything downstream (routing,
+daily digest, SNS queues, language) reads the ParsedMessage instead of
+re-scanning the text.
+
+Tags are plain hashtags: #daily, #threads, #mastodon.
+Directives add arguments separated by "::":
+    #SNS::threads::now       queue for Threads with timing "now"
+    #SNS::mastodon::19:30    queue for Mastodon with timing "19:30"
+    #threads::tomorrow       shorthand for #SNS::threads::tomorrow
+"""
+import re
+from dataclasses import dataclass, field
+
+from utils import CHINESE_RATIO_THRESHOLD
+
+SNS_PLATFORMS = ("threads", "mastodon")
+
+# A hashtag with optional ::arguments, or a run of CJK Unified Ideographs.
+# Arguments end on a letter, digit or underscore so sentence punctuation
+# after them ("#SNS::threads::now.") stays in the text
+TOKEN_PATTERN = re.compile(
+    r'#(?P<tag>[A-Za-z0-9_]+(?:::[A-Za-z0-9_.:\-]*[A-Za-z0-9_])?)|(?P<cjk>[\u4e00-\u9fff]+)')
+
+@dataclass
+class Directive:
+    """A #name::arg::arg routing directive"""
+    name: str
+    args: list
+    platform: str = None
+    timing: str = None
+
+@dataclass
+class ParsedMessage:
+    """Everything later stages need to know about a message"""
+    text: str
+    clean_text: str
+    tags: set = field(default_factory=set)
+    directives: list = field(default_factory=list)
+    platforms: list = field(default_factory=list)
+    chinese_chars: int = 0
+    total_chars: int = 0
+    language: str = "zh"
+
+    @property
+    def wants_daily(self):
+        """#daily, or no SNS routing at all, sends a message to the digest"""
+        return 'daily' in self.tags or not self.platforms
+
+    def timing_for(self, platform):
+        """The timing argument given for a platform, if any"""
+        for directive in self.directives:
+            if directive.platform == platform and directive.timing:
+                return directive.timing
+        return None
+
+def _make_directive(parts):
+    """Interpret a tag split on '::' as a directive"""
+    name = parts[0].lower()
+    args = parts[1:]
+    directive = Directive(name=name, args=args)
+    if name == 'sns' and args and args[0].lower() in SNS_PLATFORMS:
+        directive.platform = args[0].lower()
+        directive.timing = args[1].lower() if len(args) > 1 else None
+    elif name in SNS_PLATFORMS:
+        directive.platform = name
+        directive.timing = args[0].lower() if args else None
+    return directive
+
+def parse_message(text):
+    """Parse message text in one pass. Returns a ParsedMessage."""
+    tags = set()
+    directives = []
+    routed = set()
+    clean_parts = []
+    chinese_chars = 0
+    position = 0
+
+    for match in TOKEN_PATTERN.finditer(text):
+        cjk = match.group('cjk')
+        if cjk is not None:
+            chinese_chars += len(cjk)
+            continue
+
+        # Drop the tag from the clean text
+        clean_parts.append(text[position:match.start()])
+        position = match.end()
+
+        parts = match.group('tag').split('::')
+        if len(parts) == 1:
+            tag = parts[0].lower()
+            tags.add(tag)
+            if tag in SNS_PLATFORMS:
+                routed.add(tag)
+        else:
+            directive = _make_directive(parts)
+            directives.append(directive)
+            tags.add(directive.name)
+            if directive.platform:
+                routed.add(directive.platform)
+
+    clean_parts.append(text[position:])
+    total_chars = len(text)
+
+    # Same rule as utils.detect_language: default to Chinese for empty text
+    if total_chars == 0 or chinese_chars / total_chars > CHINESE_RATIO_THRESHOLD:
+        language = 'zh'
+    else:
+        language = 'en'
+
+    return ParsedMessage(
+        text=text,
+        clean_text="".join(clean_parts).strip(),
+        tags=tags,
+        directives=directives,
+        platforms=[platform for platform in SNS_PLATFORMS if platform in routed],
+        chinese_chars=chinese_chars,
+        total_chars=total_chars,
+        language=language,
+    )
@@ -0,0 +1,220 @@
+# scripts/metrics.py
+"""
+In-process counters, gauges and histograms in the Prometheus text format.
+
+Pipeline stages are timed into one histogram labelled by stage:
+
+    @metrics.timed("get_updates")
+    def get_updates(...): ...
+
+    with metrics.timed("daily_append"):
+        ...
+
+write_textfile() renders every metric to bot_data/metrics.prom (atomically,
+for node_exporter's textfile collector or for reading after a cron run), and
+serve_metrics() exposes the same text on a local /metrics endpoint.
+"""
+import os
+import time
+import threading
+import functools
+
+METRICS_PATH = os.environ.get('FLOW_METRICS_PATH', 'bot_data/metrics.prom')
+# Seconds; long polls can legitimately take up to a minute
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = {}
+_collectors = []
+_lock = threading.Lock()
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    """A value that only goes up, per label set"""
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in sorted(self.values.items())]
+
+class Gauge(Counter):
+    """A value that can be set to anything, per label set"""
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+class Histogram(Counter):
+    """Cumulative bucket counts plus sum and count, per label set"""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            # Buckets are cumulative: a value counts towards every bound it fits under
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", key + (("le", _format_value(bound)),), bucket_count))
+                samples.append((f"{self.name}_bucket", key + (("le", "+Inf"),), count))
+                samples.append((f"{self.name}_sum", key, total))
+                samples.append((f"{self.name}_count", key, count))
+        return samples
+
+    def time(self, **labels):
+        """Timer for this histogram, usable as a context manager or decorator"""
+        return Timer(self, labels)
+
+class Timer:
+    """Observe the wall time of a block or of every call to a function"""
+
+    def __init__(self, histogram, labels, errors=None):
+        self.histogram = histogram
+        self.labels = labels
+        self.errors = errors
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        if exc_type is not None and self.errors is not None:
+            self.errors.inc(**self.labels)
+        return False
+
+    def __call__(self, func):
+        # A fresh timer per call, so concurrent and nested calls don't share a start time
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Timer(self.histogram, self.labels, self.errors):
+                return func(*args, **kwargs)
+        return wrapper
+
+def _register(metric):
+    with _lock:
+        existing = _registry.get(metric.name)
+        if existing is not None:
+            return existing
+        _registry[metric.name] = metric
+        return metric
+
+def counter(name, help_text, labelnames=()):
+    """Get or create a counter"""
+    return _register(Counter(name, help_text, labelnames))
+
+def gauge(name, help_text, labelnames=()):
+    """Get or create a gauge"""
+    return _register(Gauge(name, help_text, labelnames))
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """Get or create a histogram"""
+    return _register(Histogram(name, help_text, labelnames, buckets))
+
+def register_collector(collect):
+    """Call collect() before every render, e.g. to refresh gauges from storage"""
+    _collectors.append(collect)
+
+# Metrics shared across the bot
+STAGE_SECONDS = histogram('flow_stage_seconds', 'Time spent in each pipeline stage', ['stage'])
+STAGE_ERRORS = counter('flow_stage_errors_total', 'Exceptions raised by each pipeline stage', ['stage'])
+UPDATES = counter('flow_updates_total', 'Telegram updates handled, by outcome', ['outcome'])
+TELEGRAM_SENDS = counter('flow_telegram_messages_sent_total', 'sendMessage calls, by result', ['result'])
+SNS_POSTS = counter('flow_sns_posts_total', 'SNS post attempts, by platform and result', ['platform', 'result'])
+QUEUE_DEPTH = gauge('flow_queue_depth', 'Items waiting in each SNS queue', ['platform'])
+
+def timed(stage):
+    """Time a pipeline stage into flow_stage_seconds; a context manager or decorator"""
+    return Timer(STAGE_SECONDS, {"stage": stage}, STAGE_ERRORS)
+
+def render():
+    """Every metric in the Prometheus text exposition format"""
+    for collect in list(_collectors):
+        try:
+            collect()
+        except Exception as e:
+            print(f"Error collecting metrics: {e}")
+
+    lines = []
+    with _lock:
+        metrics = sorted(_registry.values(), key=lambda metric: metric.name)
+    for metric in metrics:
+        samples = metric.samples()
+        if not samples:
+            continue
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in samples:
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+def write_textfile(path=METRICS_PATH):
+    """Write all metrics to a file atomically"""
+    from utils import atomic_write_text
+    try:
+        atomic_write_text(path, render())
+        return True
+    except Exception as e:
+        print(f"Error writing metrics to {path}: {e}")
+        return False
+
+def serve_metrics(port, host='127.0.0.1'):
+    """Expose /metrics over HTTP on a background thread. Returns the server."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# scripts/profiling.py
+"""
+Run a telegram_handler action under cProfile and tracemalloc.
+
+    python scripts/telegram_handler.py --action process --profile
+
+Each run writes three files to profiles/, named <action>-<timestamp>:
+
+    .pstats  raw cProfile stats (load with pstats or snakeviz)
+    .txt     top functions by cumulative time and top allocation sites
+    .json    the same summary in machine-readable form
+
+cProfile only sees the thread that enables it, so every thread started
+during the run (digest writers, media downloads, reply sends) gets a
+profiler of its own, and their stats are merged into the report. Threads
+that already existed when profiling started are not covered.
+
+Two runs can be diffed by function:
+
+    python scripts/profiling.py compare profiles/process-20250312-074810 profiles/process-20250313-081502
+"""
+import os
+import sys
+import io
+import json
+import time
+import pstats
+import argparse
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+
+PROFILE_DIR = 'profiles'
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 20
+TRACEMALLOC_FRAMES = 5
+
+def _function_name(key):
+    filename, line, name = key
+    return f"{os.path.basename(filename)}:{line}({name})" if line else name
+
+def _top_functions(stats, limit=TOP_FUNCTIONS):
+    rows = []
+    for key, (primitive_calls, total_calls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({"function": _function_name(key), "calls": total_calls,
+                     "tottime": round(tottime, 6), "cumtime": round(cumtime, 6)})
+    rows.sort(key=lambda row: row["cumtime"], reverse=True)
+    return rows[:limit]
+
+def _top_allocations(snapshot, limit=TOP_ALLOCATIONS):
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ))
+    return [{"location": f"{os.path.relpath(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+             "size": stat.size, "count": stat.count}
+            for stat in snapshot.statistics('lineno')[:limit]]
+
+def profile_call(label, func, *args, output_dir=PROFILE_DIR, **kwargs):
+    """Call func under cProfile and tracemalloc and write the reports. Returns func's result."""
+    os.makedirs(output_dir, exist_ok=True)
+    base = os.path.join(output_dir, f"{label}-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+
+    profilers = [cProfile.Profile()]
+    profilers_lock = threading.Lock()
+
+    def profile_thread(frame, event, arg):
+        # Called on a new thread's first event; hand the thread to its own profiler
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        with profilers_lock:
+            profilers.append(profiler)
+        profiler.enable()
+
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+    start = time.perf_counter()
+    try:
+        threading.setprofile(profile_thread)
+        profilers[0].enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profilers[0].disable()
+            threading.setprofile(None)
+    finally:
+        wall_seconds = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        with profilers_lock:
+            stats = pstats.Stats(*profilers)
+        _write_reports(base, label, stats, snapshot, wall_seconds, peak_bytes)
+
+def _write_reports(base, label, stats, snapshot, wall_seconds, peak_bytes):
+    stats.dump_stats(base + '.pstats')
+    summary = {
+        "action": label,
+        "timestamp": datetime.now().isoformat(),
+        "wall_seconds": round(wall_seconds, 6),
+        "peak_bytes": peak_bytes,
+        "functions": _top_functions(stats),
+        "allocations": _top_allocations(snapshot),
+    }
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+
+    text = io.StringIO()
+    text.write(f"{label}: {wall_seconds:.3f} s wall, {peak_bytes / 1024:.0f} KB peak traced memory\n\n")
+    stats.stream = text
+    stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    text.write("Top allocation sites:\n")
+    for allocation in summary["allocations"]:
+        text.write(f"  {allocation['size'] / 1024:10.1f} KB {allocation['count']:8d} blocks  {allocation['location']}\n")
+    with open(base + '.txt', 'w', encoding='utf-8') as f:
+        f.write(text.getvalue())
+
+    print(f"Profile written to {base}.(pstats|txt|json)")
+
+def _base_path(path):
+    for extension in ('.pstats', '.json', '.txt'):
+        if path.endswith(extension):
+            return path[:-len(extension)]
+    return path
+
+def compare(before, after, limit=TOP_FUNCTIONS):
+    """Print per-function cumulative/total time changes between two profile runs"""
+    before, after = _base_path(before), _base_path(after)
+    old_stats = pstats.Stats(before + '.pstats').stats
+    new_stats = pstats.Stats(after + '.pstats').stats
+
+    lines = []
+    for path in (before, after):
+        try:
+            with open(path + '.json', 'r', encoding='utf-8') as f:
+                summary = json.load(f)
+            lines.append(f"{os.path.basename(path)}: {summary['wall_seconds']:.3f} s wall, "
+                         f"{summary['peak_bytes'] / 1024:.0f} KB peak")
+        except (OSError, ValueError, KeyError):
+            pass
+
+    rows = []
+    for key in set(old_stats) | set(new_stats):
+        old = old_stats.get(key, (0, 0, 0.0, 0.0, None))
+        new = new_stats.get(key, (0, 0, 0.0, 0.0, None))
+        rows.append((new[3] - old[3], new[2] - old[2], old[3], new[3], old[1], new[1], _function_name(key)))
+    rows.sort(key=lambda row: abs(row[0]), reverse=True)
+
+    lines.append(f"\n{'cumtime before':>15} {'after':>10} {'delta':>10} {'tottime delta':>14} {'calls':>15}  function")
+    for cum_delta, tot_delta, old_cum, new_cum, old_calls, new_calls, name in rows[:limit]:
+        lines.append(f"{old_cum:15.4f} {new_cum:10.4f} {cum_delta:+10.4f} {tot_delta:+14.4f} "
+                     f"{f'{old_calls}->{new_calls}':>15}  {name}")
+    report = "\n".join(lines)
+    print(report)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Work with profiles written by --profile')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    compare_parser = subcommands.add_parser('compare', help='Diff two profile runs by function')
+    compare_parser.add_argument('before', help='Earlier run (path with or without extension)')
+    compare_parser.add_argument('after', help='Later run (path with or without extension)')
+    compare_parser.add_argument('--limit', type=int, default=TOP_FUNCTIONS, help='Rows to show')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        compare(args.before, args.after, args.limit)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
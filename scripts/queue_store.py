@@ -0,0 +1,249 @@
+# scripts/queue_store.py
+"""
+SNS queue storage backed by SQLite.
+
+Each queued post is one row indexed by (platform, priority, enqueued_at),
+so enqueue, peek and dequeue are O(log n) instead of loading and
+re-dumping the whole queues.json. The database runs in WAL mode; the old
+bot_data/queues.json is imported once on first use.
+
+Posts go out in priority order, oldest first within a priority, and never
+before their not_before time (Unix seconds, 0 for "whenever"). Urgent
+posts skip the channel's post windows altogether.
+"""
+import os
+import json
+import atexit
+import sqlite3
+import time
+import threading
+from datetime import datetime
+
+QUEUE_DB_PATH = 'bot_data/queues.db'
+LEGACY_QUEUES_PATH = 'bot_data/queues.json'
+DEFAULT_PLATFORMS = ["threads", "mastodon", "telegram"]
+PAGE_SIZE = 20
+
+# Lower goes first. Urgent posts don't wait for a post window.
+PRIORITY_URGENT = 0
+PRIORITY_HIGH = 1
+PRIORITY_NORMAL = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    platform TEXT NOT NULL,
+    enqueued_at TEXT NOT NULL,
+    text TEXT NOT NULL,
+    message_id TEXT,
+    priority INTEGER NOT NULL DEFAULT 2,
+    not_before REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Created after any missing columns have been added to an older database
+INDEXES = """
+DROP INDEX IF EXISTS idx_queue_items_platform_enqueued;
+CREATE INDEX IF NOT EXISTS idx_queue_items_platform_priority
+    ON queue_items (platform, priority, enqueued_at, id);
+CREATE INDEX IF NOT EXISTS idx_queue_items_priority_not_before
+    ON queue_items (priority, not_before);
+"""
+
+# Columns added since the first version of the schema
+ADDED_COLUMNS = {
+    "priority": "INTEGER NOT NULL DEFAULT 2",
+    "not_before": "REAL NOT NULL DEFAULT 0",
+}
+
+# Posting order
+ORDER = "ORDER BY priority, enqueued_at, id"
+
+# One connection per database path for the life of the process, shared by
+# threads; the lock keeps their transactions from interleaving
+_connections = {}
+_lock = threading.RLock()
+
+def _row_to_item(row):
+    """Convert a queue_items row to the dict shape the rest of the bot uses"""
+    return {
+        "id": row["id"],
+        "text": row["text"],
+        "message_id": row["message_id"],
+        "timestamp": row["enqueued_at"],
+        "priority": row["priority"],
+        "not_before": row["not_before"] or None,
+    }
+
+def get_connection(db_path=QUEUE_DB_PATH, legacy_path=LEGACY_QUEUES_PATH):
+    """Open (or reuse) the queue database, creating and migrating it if needed"""
+    with _lock:
+        conn = _connections.get(db_path)
+        if conn is None:
+            conn = _open_connection(db_path)
+            if legacy_path:
+                migrate_from_json(legacy_path, db_path)
+    return conn
+
+def _open_connection(db_path):
+    """Create the database file and schema and cache the connection"""
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(queue_items)")}
+    for column, definition in ADDED_COLUMNS.items():
+        if column not in columns:
+            conn.execute(f"ALTER TABLE queue_items ADD COLUMN {column} {definition}")
+    conn.executescript(INDEXES)
+    _connections[db_path] = conn
+    return conn
+
+def close_connections():
+    """Checkpoint the WAL into the main file and close every open connection"""
+    with _lock:
+        for db_path, conn in list(_connections.items()):
+            try:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                conn.close()
+                del _connections[db_path]
+
+# Fold the WAL back into queues.db before the workflow commits bot_data/
+atexit.register(close_connections)
+
+def migrate_from_json(legacy_path=LEGACY_QUEUES_PATH, db_path=QUEUE_DB_PATH):
+    """Import a legacy queues.json once. Returns the number of items imported."""
+    conn = get_connection(db_path, legacy_path=None)
+    with _lock:
+        migrated = conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_json'").fetchone()
+    if migrated:
+        return 0
+    if not os.path.exists(legacy_path):
+        return 0
+
+    try:
+        with open(legacy_path, 'r', encoding='utf-8') as f:
+            queues = json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"Error loading legacy queues for migration: {e}")
+        return 0
+
+    rows = []
+    for platform, items in queues.items():
+        for item in items:
+            rows.append((platform, item.get("timestamp") or datetime.now().isoformat(),
+                         item.get("text", ""), item.get("message_id")))
+
+    with _lock, conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "INSERT INTO queue_items (platform, enqueued_at, text, message_id) VALUES (?, ?, ?, ?)", rows)
+        conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+                     (datetime.now().isoformat(),))
+
+    # Keep the old file around for reference, but out of the way
+    os.replace(legacy_path, legacy_path + '.migrated')
+    return len(rows)
+
+def enqueue_many(posts_by_platform, db_path=QUEUE_DB_PATH, meta=None):
+    """Append posts to several platform queues in one transaction.
+
+    meta ({key: value}) is stored in the same transaction, so a checkpoint
+    saved alongside the posts can never disagree with them.
+    """
+    rows = [(platform, post.get("timestamp") or datetime.now().isoformat(),
+             post["text"], post.get("message_id"),
+             post.get("priority", PRIORITY_NORMAL), post.get("not_before") or 0)
+            for platform, posts in posts_by_platform.items() for post in posts]
+    conn = get_connection(db_path)
+    with _lock, conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "INSERT INTO queue_items (platform, enqueued_at, text, message_id, priority, not_before) "
+            "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        if meta:
+            conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta.items())
+    return len(rows)
+
+def get_meta(key, db_path=QUEUE_DB_PATH):
+    """A value stored in the meta table, or None"""
+    conn = get_connection(db_path)
+    with _lock:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else None
+
+def enqueue(platform, post, db_path=QUEUE_DB_PATH):
+    """Append one post to a platform queue"""
+    return enqueue_many({platform: [post]}, db_path)
+
+def peek(platform, db_path=QUEUE_DB_PATH, now=None, max_priority=PRIORITY_NORMAL):
+    """Return the next item that may be posted now, without removing it.
+
+    Only items whose not_before has passed and whose priority is at most
+    max_priority count. The index hands them over in posting order, so
+    this only steps over items that are still waiting.
+    """
+    conn = get_connection(db_path)
+    with _lock:
+        row = conn.execute(
+            f"SELECT * FROM queue_items WHERE platform = ? AND priority <= ? AND not_before <= ? {ORDER} LIMIT 1",
+            (platform, max_priority, time.time() if now is None else now)).fetchone()
+    return _row_to_item(row) if row else None
+
+def next_ready_time(platforms, max_priority=PRIORITY_URGENT, db_path=QUEUE_DB_PATH):
+    """Earliest not_before of any item on the given platforms at or above a priority, or None if there are none"""
+    platforms = list(platforms)
+    if not platforms:
+        return None
+    placeholders = ", ".join("?" * len(platforms))
+    conn = get_connection(db_path)
+    with _lock:
+        row = conn.execute(
+            f"SELECT MIN(not_before) FROM queue_items WHERE platform IN ({placeholders}) AND priority <= ?",
+            (*platforms, max_priority)).fetchone()
+    return row[0]
+
+def remove(item_id, db_path=QUEUE_DB_PATH):
+    """Delete an item by ID. Returns True if it was still queued."""
+    conn = get_connection(db_path)
+    with _lock, conn:
+        cursor = conn.execute("DELETE FROM queue_items WHERE id = ?", (item_id,))
+    return cursor.rowcount > 0
+
+def dequeue(platform, db_path=QUEUE_DB_PATH):
+    """Remove and return the first item in a platform queue, in posting order"""
+    conn = get_connection(db_path)
+    with _lock, conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            f"SELECT * FROM queue_items WHERE platform = ? {ORDER} LIMIT 1", (platform,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("DELETE FROM queue_items WHERE id = ?", (row["id"],))
+    return _row_to_item(row)
+
+def count(platform, db_path=QUEUE_DB_PATH):
+    """Number of items waiting in a platform queue"""
+    conn = get_connection(db_path)
+    with _lock:
+        return conn.execute(
+            "SELECT COUNT(*) FROM queue_items WHERE platform = ?", (platform,)).fetchone()[0]
+
+def list_page(platform, page=1, page_size=PAGE_SIZE, db_path=QUEUE_DB_PATH):
+    """Return one page (1-based) of a platform queue in posting order"""
+    conn = get_connection(db_path)
+    with _lock:
+        rows = conn.execute(
+            f"SELECT * FROM queue_items WHERE platform = ? {ORDER} LIMIT ? OFFSET ?",
+            (platform, page_size, (max(page, 1) - 1) * page_size)).fetchall()
+    return [_row_to_item(row) for row in rows]
@@ -0,0 +1,76 @@
+# scripts/reply_buffer.py
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import send_telegram_message
+
+logger = logging.getLogger("Reply Buffer")
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+
+def summarize_lines(lines):
+    """Collapse repeated lines into one line with a count, keeping first-seen order"""
+    counts = {}
+    for line in lines:
+        counts[line] = counts.get(line, 0) + 1
+    return [line if count == 1 else f"{line} (×{count})" for line, count in counts.items()]
+
+def split_message(lines, limit=MAX_MESSAGE_LENGTH):
+    """Join lines into as few messages as fit under Telegram's length limit"""
+    messages = []
+    current = ""
+    for line in lines:
+        line = line[:limit]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            messages.append(current)
+            candidate = line
+        current = candidate
+    if current:
+        messages.append(current)
+    return messages
+
+class ReplyBuffer:
+    """Collect confirmation replies for a batch and send one summary per chat.
+
+    flush() hands the summaries to a single background sender thread, so
+    processing never waits on Telegram and messages keep their order.
+    """
+
+    def __init__(self, send=send_telegram_message):
+        self.send = send
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="replies")
+
+    def add(self, chat_id, text):
+        """Queue a reply line for a chat"""
+        with self.lock:
+            self.pending.setdefault(chat_id, []).append(text)
+
+    def flush(self, wait=False):
+        """Send everything queued so far, one summary message per chat"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+
+        for chat_id, lines in pending.items():
+            for message in split_message(summarize_lines(lines)):
+                self.executor.submit(self._send, chat_id, message)
+        if wait:
+            # The sender is a single FIFO thread, so once this no-op has run
+            # every earlier reply (including ones from previous flushes) is sent
+            self.executor.submit(lambda: None).result()
+
+    def _send(self, chat_id, message):
+        try:
+            if not self.send(chat_id, message):
+                logger.error(f"Failed to send reply to chat {chat_id}")
+        except Exception as e:
+            logger.error(f"Exception while sending reply to chat {chat_id}: {e}")
+
+    def close(self):
+        """Flush remaining replies and wait for them to be sent"""
+        self.flush()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,119 @@
+# scripts/scheduler.py
+"""
+Posting schedule for SNS channels.
+
+Each channel's post windows come pre-parsed from config.load() as sorted
+(hour, minute) pairs. A window becomes due when its fire time has passed,
+stays due for a grace period (so a delayed cron tick still catches it) and
+is recorded as consumed once a post goes out, so each window posts at most
+once no matter how many ticks land inside it.
+
+A directive's timing argument (#SNS::threads::now, #mastodon::19:30,
+#threads::tomorrow) becomes a queue priority and a not-before time.
+"""
+import re
+from datetime import datetime, timedelta
+
+from utils import load_json_file, save_json_file, VANCOUVER_TZ
+from queue_store import PRIORITY_URGENT, PRIORITY_HIGH, PRIORITY_NORMAL
+
+SCHEDULE_STATE_PATH = 'bot_data/schedule_state.json'
+# How long after its fire time a window can still be posted in
+GRACE_PERIOD = timedelta(minutes=90)
+
+# Timing arguments that only change a post's priority
+TIMING_PRIORITIES = {"now": PRIORITY_URGENT, "urgent": PRIORITY_URGENT,
+                     "next": PRIORITY_HIGH, "high": PRIORITY_HIGH}
+CLOCK_TIME_PATTERN = re.compile(r'^(\d{1,2}):(\d{2})$')
+
+def _fire_times(windows, now, days):
+    """Fire times of the windows on each day offset in `days`, in order"""
+    for offset in days:
+        day = now + timedelta(days=offset)
+        for hour, minute in windows:
+            yield day.replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+def due_window(platform, windows, now, state):
+    """Return the fire time of the window that should post now, or None.
+
+    windows are sorted (hour, minute) pairs. A window is due if it fired
+    within GRACE_PERIOD and has not already been consumed for this platform.
+    """
+    consumed = state.get(platform)
+    consumed = datetime.fromisoformat(consumed) if consumed else None
+
+    latest = None
+    for fire_time in _fire_times(windows, now, (-1, 0)):
+        if fire_time > now:
+            break
+        latest = fire_time
+
+    if latest is None or now - latest > GRACE_PERIOD:
+        return None
+    if consumed is not None and consumed >= latest:
+        return None
+    return latest
+
+def next_fire_time(windows, now):
+    """The first window fire time strictly after now"""
+    for fire_time in _fire_times(windows, now, (0, 1)):
+        if fire_time > now:
+            return fire_time
+    return None
+
+def seconds_until_next_window(channels, now):
+    """Seconds until the next window of any of the channels (None if none)"""
+    fire_times = [next_fire_time(channel.windows, now) for channel in channels]
+    fire_times = [fire_time for fire_time in fire_times if fire_time is not None]
+    if not fire_times:
+        return None
+    return max((min(fire_times) - now).total_seconds(), 0)
+
+def _clock_time(timing):
+    """(hour, minute) for an "HH:MM" timing argument, else None"""
+    match = CLOCK_TIME_PATTERN.match(timing)
+    if match and int(match.group(1)) < 24 and int(match.group(2)) < 60:
+        return int(match.group(1)), int(match.group(2))
+    return None
+
+def is_known_timing(timing):
+    """Whether post_schedule understands a timing argument"""
+    return timing in TIMING_PRIORITIES or timing == "tomorrow" or _clock_time(timing) is not None
+
+def post_schedule(timing, at):
+    """(priority, not_before datetime or None) for a timing argument given at time at.
+
+    "now"/"urgent" post without waiting for a window, "next"/"high" jump the
+    queue at the next window, "HH:MM" posts at that (Vancouver) time without
+    waiting for a window, and "tomorrow" holds the post for tomorrow's first
+    window. Anything else is queued normally; check is_known_timing first
+    to tell the user.
+    """
+    if not timing:
+        return PRIORITY_NORMAL, None
+    if timing in TIMING_PRIORITIES:
+        return TIMING_PRIORITIES[timing], None
+
+    # Wall-clock arithmetic in Vancouver time so DST changes land correctly
+    local = at.astimezone(VANCOUVER_TZ)
+    if timing == "tomorrow":
+        return PRIORITY_NORMAL, (local + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    clock_time = _clock_time(timing)
+    if clock_time:
+        not_before = local.replace(hour=clock_time[0], minute=clock_time[1], second=0, microsecond=0)
+        if not_before <= local:
+            not_before += timedelta(days=1)
+        return PRIORITY_URGENT, not_before
+    return PRIORITY_NORMAL, None
+
+def load_state(path=SCHEDULE_STATE_PATH):
+    """Load the consumed-window state ({platform: ISO fire time})"""
+    return load_json_file(path, {})
+
+def mark_consumed(state, platform, fire_time):
+    """Record that a platform has posted in the window firing at fire_time"""
+    state[platform] = fire_time.isoformat()
+
+def save_state(state, path=SCHEDULE_STATE_PATH):
+    """Persist the consumed-window state"""
+    return save_json_file(path, state)
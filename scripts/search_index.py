@@ -0,0 +1,345 @@
+# scripts/search_index.py
+"""
+Full-text search over daily digests, posts and 细糠 entries.
+
+Each "## HH:MM" section of a digest (or the whole body of a post) is one
+document. Text is split the same way detect_language sees it: runs of
+U+4E00-U+9FFF are indexed as single characters plus character bigrams, and
+everything else as lowercase Latin word tokens. Postings live in SQLite
+(bot_data/search.db), so a query is a few index lookups and never rescans
+content/.
+
+search.db isn't committed, so it is built on demand by the search actions
+(the first search, sync(), export). Once it exists write_daily_sections
+feeds appended sections straight into it; a capture run on a fresh
+checkout leaves it alone. sync() catches up with any other edits by
+comparing file mtimes and sizes.
+"""
+import os
+import re
+import json
+import atexit
+import sqlite3
+import threading
+from collections import Counter
+from datetime import datetime
+
+from utils import atomic_write_text
+from content_index import CONTENT_DIRS, SECTION_PATTERN, split_front_matter, entry_date, scan_tree
+
+SEARCH_DB_PATH = 'bot_data/search.db'
+EXPORT_DIR = 'static/search'
+EXPORT_SHARDS = 16
+SNIPPET_RADIUS = 30
+# Characters of each document kept in the exported docs.json
+EXPORT_PREVIEW_LENGTH = 120
+
+# The same CJK range detect_language counts as Chinese, or a Latin word
+TOKEN_PATTERN = re.compile(r'[\u4e00-\u9fff]+|[A-Za-z0-9]+')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    section TEXT NOT NULL,
+    title TEXT,
+    date TEXT,
+    text TEXT NOT NULL,
+    UNIQUE (path, position)
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (term, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id);
+"""
+
+# One connection per database path, shared by threads like queue_store's
+_connections = {}
+_lock = threading.RLock()
+# Databases checked for (and given) their first full build
+_built = set()
+
+def _is_cjk(run):
+    return '\u4e00' <= run[0] <= '\u9fff'
+
+def tokenize(text):
+    """Count the index terms in a piece of text"""
+    terms = Counter()
+    for match in TOKEN_PATTERN.finditer(text):
+        run = match.group()
+        if _is_cjk(run):
+            terms.update(run)
+            terms.update(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms[run.lower()] += 1
+    return terms
+
+def query_terms(query):
+    """Terms a document must contain to match a query"""
+    terms = []
+    for match in TOKEN_PATTERN.finditer(query):
+        run = match.group()
+        if not _is_cjk(run):
+            terms.append(run.lower())
+        elif len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return list(dict.fromkeys(terms))
+
+def split_documents(body):
+    """(section, text) pairs for a file body: one per "## HH:MM" section, plus any preamble"""
+    documents = []
+    matches = list(SECTION_PATTERN.finditer(body))
+    preamble = body[:matches[0].start()] if matches else body
+    if preamble.strip():
+        documents.append(("", preamble.strip()))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(body)
+        text = body[match.end():end].strip()
+        if text:
+            documents.append((match.group(1), text))
+    return documents
+
+def get_connection(db_path=SEARCH_DB_PATH, roots=CONTENT_DIRS, build=True):
+    """Open (or reuse) the search database, building it from content/ on first use unless build is False"""
+    with _lock:
+        conn = _connections.get(db_path)
+        if conn is None:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            _connections[db_path] = conn
+        if build and db_path not in _built:
+            if conn.execute("SELECT 1 FROM files LIMIT 1").fetchone() is None:
+                _sync(conn, roots)
+            _built.add(db_path)
+    return conn
+
+def close_connections():
+    """Checkpoint the WAL and close every open connection"""
+    with _lock:
+        for db_path, conn in list(_connections.items()):
+            try:
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                conn.close()
+                del _connections[db_path]
+
+atexit.register(close_connections)
+
+def _add_documents(conn, path, title, date, documents, first_position=0):
+    """Insert documents and their postings for one file"""
+    for offset, (section, text) in enumerate(documents):
+        cursor = conn.execute(
+            "INSERT INTO docs (path, position, section, title, date, text) VALUES (?, ?, ?, ?, ?, ?)",
+            (path, first_position + offset, section, title, date, text))
+        conn.executemany(
+            "INSERT INTO postings (term, doc_id, count) VALUES (?, ?, ?)",
+            [(term, cursor.lastrowid, count) for term, count in tokenize(text).items()])
+
+def _remove_file(conn, path):
+    conn.execute("DELETE FROM postings WHERE doc_id IN (SELECT id FROM docs WHERE path = ?)", (path,))
+    conn.execute("DELETE FROM docs WHERE path = ?", (path,))
+    conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+def _index_file(conn, path, stat=None):
+    """(Re)index a whole file inside the caller's transaction"""
+    stat = stat or os.stat(path)
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        text = f.read()
+    front_matter, body = split_front_matter(text)
+    title = str(front_matter.get('title', os.path.splitext(os.path.basename(path))[0]))
+    _remove_file(conn, path)
+    _add_documents(conn, path, title, entry_date(path, front_matter), split_documents(body))
+    conn.execute("INSERT INTO files (path, mtime_ns, size) VALUES (?, ?, ?)",
+                 (path, stat.st_mtime_ns, stat.st_size))
+
+def _sync(conn, roots):
+    found = scan_tree(roots)
+    known = {row["path"]: (row["mtime_ns"], row["size"])
+             for row in conn.execute("SELECT path, mtime_ns, size FROM files")}
+    reindexed = 0
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for path in set(known) - set(found):
+            _remove_file(conn, path)
+        for path, stat in found.items():
+            if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                continue
+            try:
+                _index_file(conn, path, stat)
+                reindexed += 1
+            except OSError as e:
+                print(f"Error indexing {path}: {e}")
+    return reindexed
+
+def sync(db_path=SEARCH_DB_PATH, roots=CONTENT_DIRS):
+    """Reindex files changed outside the bot. Returns the number of files reindexed."""
+    conn = get_connection(db_path, roots)
+    with _lock:
+        return _sync(conn, roots)
+
+def index_appended(path, appended_text, title, before_stat=None, db_path=SEARCH_DB_PATH):
+    """Index sections just appended to a digest.
+
+    before_stat is the file's stat from before the write (None if the write
+    created it). If the index was current at that point only the new
+    sections are tokenized; otherwise the one file is reindexed in full.
+    Does nothing until a search action has built the index.
+    """
+    if db_path not in _connections and not os.path.exists(db_path):
+        return
+    conn = get_connection(db_path, build=False)
+    with _lock, conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("SELECT 1 FROM files LIMIT 1").fetchone() is None:
+            # An unbuilt index; one file in it would stop the full build
+            return
+        row = conn.execute("SELECT mtime_ns, size FROM files WHERE path = ?", (path,)).fetchone()
+        stat = os.stat(path)
+        if row is not None and (row["mtime_ns"], row["size"]) == (stat.st_mtime_ns, stat.st_size):
+            # Already indexed, e.g. by a sync that just ran
+            return
+        if before_stat is None or row is None or \
+                (row["mtime_ns"], row["size"]) != (before_stat.st_mtime_ns, before_stat.st_size):
+            _index_file(conn, path)
+            return
+
+        last = conn.execute("SELECT MAX(position), MAX(title) FROM docs WHERE path = ?", (path,)).fetchone()
+        first_position = last[0] + 1 if last[0] is not None else 0
+        _add_documents(conn, path, last[1] or title, entry_date(path, {}),
+                       split_documents(appended_text), first_position)
+        conn.execute("UPDATE files SET mtime_ns = ?, size = ? WHERE path = ?",
+                     (stat.st_mtime_ns, stat.st_size, path))
+
+def _snippet(text, query):
+    """A short excerpt around the first place the query appears"""
+    flat = " ".join(text.split())
+    needle = next((match.group() for match in TOKEN_PATTERN.finditer(query)), "")
+    position = flat.lower().find(needle.lower()) if needle else -1
+    if position < 0:
+        return flat[:SNIPPET_RADIUS * 2] + ("..." if len(flat) > SNIPPET_RADIUS * 2 else "")
+    start = max(0, position - SNIPPET_RADIUS)
+    end = position + len(needle) + SNIPPET_RADIUS
+    return ("..." if start else "") + flat[start:end] + ("..." if end < len(flat) else "")
+
+def search(query, limit=10, db_path=SEARCH_DB_PATH):
+    """Documents containing every term of the query, best matches first"""
+    terms = query_terms(query)
+    if not terms:
+        return []
+    placeholders = ",".join("?" * len(terms))
+    conn = get_connection(db_path)
+    with _lock:
+        rows = conn.execute(
+            f"""SELECT docs.*, SUM(postings.count) AS score
+                FROM postings JOIN docs ON docs.id = postings.doc_id
+                WHERE postings.term IN ({placeholders})
+                GROUP BY postings.doc_id
+                HAVING COUNT(*) = ?
+                ORDER BY score DESC, docs.date DESC, docs.id DESC""",
+            (*terms, len(terms))).fetchall()
+
+    # Bigrams can all match without the phrase itself being present
+    runs = [match.group().lower() for match in TOKEN_PATTERN.finditer(query)]
+    results = []
+    for row in rows:
+        text = row["text"].lower()
+        if all(run in text for run in runs):
+            results.append({
+                "path": row["path"],
+                "title": row["title"],
+                "date": row["date"],
+                "section": row["section"],
+                "snippet": _snippet(row["text"], query),
+            })
+            if len(results) >= limit:
+                break
+    return results
+
+def format_results(query, results):
+    """Render search results as a Telegram message"""
+    if not results:
+        return f"No captures match \"{query}\"."
+    lines = [f"🔎 {query}"]
+    for result in results:
+        where = f"{result['date'] or result['title']} {result['section']}".strip()
+        lines.append(f"\n{where} - {result['path']}\n{result['snippet']}")
+    return "\n".join(lines)
+
+def hugo_urlize(title):
+    """Approximate Hugo's urlize for the :title permalink token"""
+    slug = re.sub(r'\s+', '-', title.strip())
+    return "".join(char for char in slug if char.isalnum() or char in "./_-#+~").lower()
+
+def page_url(path, title, date, section=""):
+    """Site URL for a document, following the permalinks in hugo.toml"""
+    parts = path.split('/')
+    kind = parts[1] if len(parts) > 2 else ""
+    if not date or kind not in ("daily", "posts", "xikang"):
+        return None
+    year, month, day = date.split('-')
+    if kind == "daily":
+        url = f"/daily/{year}/{month}/{day}/"
+    else:
+        url = f"/{kind}/{year}/{month}/{hugo_urlize(title)}/"
+    # Hugo's heading IDs drop the colon: "## 07:48" -> #0748
+    return url + (f"#{section.replace(':', '')}" if section else "")
+
+def shard_for(term, shard_count=EXPORT_SHARDS):
+    """Shard number of a term; the search page computes the same from codePointAt(0)"""
+    return ord(term[0]) % shard_count
+
+def export_shards(output_dir=EXPORT_DIR, shard_count=EXPORT_SHARDS, db_path=SEARCH_DB_PATH):
+    """Write the index as sharded JSON for a client-side search page"""
+    conn = get_connection(db_path)
+    with _lock:
+        docs = conn.execute("SELECT * FROM docs ORDER BY date DESC, path, position").fetchall()
+        postings = conn.execute("SELECT term, doc_id, count FROM postings ORDER BY term").fetchall()
+
+    doc_numbers = {row["id"]: number for number, row in enumerate(docs)}
+    shards = [{} for _ in range(shard_count)]
+    for term, doc_id, count in postings:
+        shards[shard_for(term, shard_count)].setdefault(term, []).append([doc_numbers[doc_id], count])
+
+    exported_docs = []
+    for row in docs:
+        preview = " ".join(row["text"].split())
+        exported_docs.append({
+            "url": page_url(row["path"], row["title"], row["date"], row["section"]),
+            "title": row["title"],
+            "date": row["date"],
+            "section": row["section"],
+            "preview": preview[:EXPORT_PREVIEW_LENGTH],
+        })
+
+    def write(name, data):
+        atomic_write_text(os.path.join(output_dir, name),
+                          json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+
+    write("docs.json", exported_docs)
+    for number, shard in enumerate(shards):
+        write(f"terms-{number:02d}.json", shard)
+    write("manifest.json", {
+        "generated": datetime.now().isoformat(),
+        "shards": shard_count,
+        "docs": len(exported_docs),
+        "terms": len({term for term, _, _ in postings}),
+        "tokenizer": "cjk-unigram-bigram+latin-words",
+    })
+    return len(exported_docs)
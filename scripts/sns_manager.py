@@ -1,18 +1,48 @@
 # scripts/sns_manager.py
-import json
-import requests
 import os
 import logging
-from datetime import datetime
-import pytz
+import queue_store
+import metrics
+import workers
+import config
+from utils import request_with_retry, vancouver_now, file_lock
+import scheduler
 
 # Set up logging
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("SNS Manager")
 
-def post_to_mastodon(text, instance_url=None, access_token=None):
-    """Post content to Mastodon."""
+# (connect, read) timeout for every outbound SNS request
+REQUEST_TIMEOUT = (5, 30)
+# Keep-alive connections kept open per platform
+POOL_SIZE = 4
+# Most urgent posts sent per channel in one run, so a burst can't flood a timeline
+MAX_URGENT_POSTS_PER_RUN = 5
+
+# One pooled session per platform, so a slow instance only ties up its own connections
+_platform_sessions = {}
+
+def get_platform_session(platform):
+    """Return the keep-alive session dedicated to one platform"""
+    session = _platform_sessions.get(platform)
+    if session is None:
+        # requests is only loaded once something is actually being posted
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _platform_sessions[platform] = session
+    return session
+
+def post_to_mastodon(text, instance_url=None, access_token=None, idempotency_key=None):
+    """Post content to Mastodon.
+
+    idempotency_key identifies the queue item, so a retried request for the
+    same item isn't posted twice while identical text queued again is.
+    """
     if not instance_url:
         instance_url = os.environ.get('MASTODON_INSTANCE')
     if not access_token:
@@ -29,6 +59,9 @@ def post_to_mastodon(text, instance_url=None, access_token=None):
     headers = {
         'Authorization': f'Bearer {access_token}'
     }
+    if idempotency_key:
+        # Lets Mastodon drop a duplicate if a retried request already went through
+        headers['Idempotency-Key'] = idempotency_key
 
     data = {
         'status': text
@@ -36,10 +69,13 @@ def post_to_mastodon(text, instance_url=None, access_token=None):
 
     try:
         logger.info(f"Attempting to post to Mastodon instance: {instance_url}")
-        response = requests.post(
+        response = request_with_retry(
+            'POST',
             f'{instance_url}/api/v1/statuses',
+            session=get_platform_session("mastodon"),
             headers=headers,
-            data=data
+            data=data,
+            timeout=REQUEST_TIMEOUT
         )
 
         if response.status_code == 200:
@@ -52,7 +88,7 @@ def post_to_mastodon(text, instance_url=None, access_token=None):
         logger.error(f"Exception while posting to Mastodon: {str(e)}")
         return False, str(e)
 
-def post_to_threads(text, username=None, password=None):
+def post_to_threads(text, username=None, password=None, idempotency_key=None):
     """
     Post to Threads using API methods.
     Note: Threads does not have an official API yet, so this is a placeholder.
@@ -74,108 +110,126 @@ def post_to_threads(text, username=None, password=None):
     # In a real implementation, you'd replace this with actual API calls
     return True, "Posted successfully (simulated)"
 
-def process_sns_queues(config_path='bot_data/config.json', queues_path='bot_data/queues.json'):
-    """Process social media queues based on current time windows."""
-    # Load queues
-    try:
-        with open(queues_path, 'r') as f:
-            queues = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        logger.error(f"Error loading queues: {str(e)}")
+# Platform adapters: the posting function and the credential keys (from
+# the channel's config.json credentials) passed to it positionally, plus an
+# idempotency_key keyword naming the queue item. Add a channel by registering it here.
+PLATFORM_ADAPTERS = {
+    "threads": {"post": post_to_threads, "credentials": ("username", "password")},
+    "mastodon": {"post": post_to_mastodon, "credentials": ("instance", "token")},
+}
+
+def register_platform(name, post, credentials=()):
+    """Register a posting adapter for an SNS channel"""
+    PLATFORM_ADAPTERS[name] = {"post": post, "credentials": tuple(credentials)}
+
+def postable_channels(settings):
+    """The enabled channels that have a posting adapter, i.e. the ones that get drained"""
+    return [channel for channel in settings.enabled_channels if channel.name in PLATFORM_ADAPTERS]
+
+def drain_channel(platform, channel, queue_db_path=queue_store.QUEUE_DB_PATH,
+                  max_priority=queue_store.PRIORITY_NORMAL):
+    """Post the next eligible item of one platform queue.
+    
+    Returns True if something was posted.
+    """
+    name = platform.capitalize()
+    post = queue_store.peek(platform, queue_db_path, max_priority=max_priority)
+    if not post:
         return False
 
-    # Load config
+    adapter = PLATFORM_ADAPTERS[platform]
+    # Post the first item in the queue
+    with metrics.timed(f"post_to_{platform}"):
+        success, result = adapter["post"](post["text"], *(channel.credentials.get(key) for key in adapter["credentials"]),
+                                          idempotency_key=f"{platform}-{post['id']}")
+    metrics.SNS_POSTS.inc(platform=platform, result="ok" if success else "error")
+
+    if success:
+        logger.info(f"Posted to {name}: {post['text'][:30]}...")
+        queue_store.remove(post["id"], queue_db_path)
+        return True
+
+    # Leave it at the head of the queue if failed
+    logger.error(f"Failed to post to {name}: {result}")
+    return False
+
+def run_channel(platform, channel, fire_time, queue_db_path=queue_store.QUEUE_DB_PATH):
+    """Post a channel's due urgent items, then one item if a window is due.
+    
+    Returns (posts made, whether the window was used).
+    """
+    posted = 0
+    while posted < MAX_URGENT_POSTS_PER_RUN and \
+            drain_channel(platform, channel, queue_db_path, queue_store.PRIORITY_URGENT):
+        posted += 1
+    window_used = bool(fire_time) and drain_channel(platform, channel, queue_db_path)
+    return posted + window_used, window_used
+
+def process_sns_queues(config_path=config.CONFIG_PATH, queue_db_path=queue_store.QUEUE_DB_PATH,
+                       state_path=scheduler.SCHEDULE_STATE_PATH, urgent_only=False):
+    """Process social media queues based on current time windows.
+    
+    Urgent posts go out whenever they are due, window or not; with
+    urgent_only nothing else is posted. If another process is already
+    posting, this run does nothing rather than post the same items again.
+    """
+    with file_lock("sns_queues", blocking=False) as locked:
+        if not locked:
+            logger.info("Another run is processing the SNS queues")
+            return False
+        return _process_sns_queues(config_path, queue_db_path, state_path, urgent_only)
+
+def _process_sns_queues(config_path, queue_db_path, state_path, urgent_only):
+    # Only re-read when the file changed since the last run in this process
     try:
-        with open(config_path, 'r') as f:
-            config = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError) as e:
+        settings = config.load(config_path)
+    except config.ConfigError as e:
         logger.error(f"Error loading config: {str(e)}")
         return False
 
     # Get current time in Vancouver
-    vancouver_tz = pytz.timezone('America/Vancouver')
-    now = datetime.now(pytz.utc).astimezone(vancouver_tz)
+    now = vancouver_now()
     current_time = now.strftime('%H:%M')
 
     logger.info(f"Processing SNS queues at {current_time} (Vancouver time)")
 
+    # Find the channels with urgent posts due, or an unconsumed window due and posts waiting
+    state = scheduler.load_state(state_path)
+    due_channels = {}
+    for channel in postable_channels(settings):
+        platform = channel.name
+        if not queue_store.peek(platform, queue_db_path):
+            continue
+        fire_time = None
+        if not urgent_only:
+            logger.info(f"{platform.capitalize()} post windows: {channel.window_labels}")
+            fire_time = scheduler.due_window(platform, channel.windows, now, state)
+            if fire_time:
+                logger.info(f"Time window {fire_time.strftime('%H:%M')} matched for {platform.capitalize()} posting")
+        urgent = queue_store.peek(platform, queue_db_path, max_priority=queue_store.PRIORITY_URGENT)
+        if fire_time or urgent:
+            due_channels[platform] = (channel, fire_time)
+
+    # Every due channel is drained on its own thread
+    def drain(platform, channels):
+        channel, fire_time = channels[0]
+        return run_channel(platform, channel, fire_time, queue_db_path)
+
     changes_made = False
+    outcomes = workers.run_partitioned({platform: [due] for platform, due in due_channels.items()},
+                                       drain, max_workers=len(due_channels) or 1, name="sns")
+    for platform, (outcome, error) in outcomes.items():
+        if error is not None:
+            logger.error(f"Exception while draining {platform} queue: {str(error)}")
+            continue
+        posted, window_used = outcome
+        if window_used:
+            # The window is used up only once a post actually went out
+            scheduler.mark_consumed(state, platform, due_channels[platform][1])
+        changes_made = changes_made or posted > 0
 
-    # Process Threads queue
-    if queues.get("threads") and config.get("sns_channels", {}).get("threads", {}).get("enabled", False):
-        post_windows = config["sns_channels"]["threads"]["post_windows"]
-        logger.info(f"Threads post windows: {post_windows}")
-
-        # Check if current time matches any post window (with 5-minute margin)
-        should_post = False
-        for window in post_windows:
-            window_time = datetime.strptime(window, '%H:%M').time()
-            current_time_obj = now.time()
-
-            # Within 5 minutes of the window
-            time_diff_minutes = abs((current_time_obj.hour * 60 + current_time_obj.minute) -
-                                   (window_time.hour * 60 + window_time.minute))
-            if time_diff_minutes <= 5:
-                should_post = True
-                break
-
-        if should_post and queues["threads"]:
-            logger.info("Time window matched for Threads posting")
-            # Post the first item in the queue
-            post = queues["threads"].pop(0)
-            username = config["sns_channels"]["threads"].get("credentials", {}).get("username")
-            password = config["sns_channels"]["threads"].get("credentials", {}).get("password")
-
-            success, result = post_to_threads(post["text"], username, password)
-
-            if success:
-                logger.info(f"Posted to Threads: {post['text'][:30]}...")
-                changes_made = True
-            else:
-                # Put it back in the queue if failed
-                queues["threads"].insert(0, post)
-                logger.error(f"Failed to post to Threads: {result}")
-
-    # Process Mastodon queue
-    if queues.get("mastodon") and config.get("sns_channels", {}).get("mastodon", {}).get("enabled", False):
-        post_windows = config["sns_channels"]["mastodon"]["post_windows"]
-        logger.info(f"Mastodon post windows: {post_windows}")
-
-        # Check if current time matches any post window (with 5-minute margin)
-        should_post = False
-        for window in post_windows:
-            window_time = datetime.strptime(window, '%H:%M').time()
-            current_time_obj = now.time()
-
-            # Within 5 minutes of the window
-            time_diff_minutes = abs((current_time_obj.hour * 60 + current_time_obj.minute) -
-                                   (window_time.hour * 60 + window_time.minute))
-            if time_diff_minutes <= 5:
-                should_post = True
-                break
-
-        if should_post and queues["mastodon"]:
-            logger.info("Time window matched for Mastodon posting")
-            # Post the first item in the queue
-            post = queues["mastodon"].pop(0)
-            instance = config["sns_channels"]["mastodon"].get("credentials", {}).get("instance")
-            token = config["sns_channels"]["mastodon"].get("credentials", {}).get("token")
-
-            success, result = post_to_mastodon(post["text"], instance, token)
-
-            if success:
-                logger.info(f"Posted to Mastodon: {post['text'][:30]}...")
-                changes_made = True
-            else:
-                # Put it back in the queue if failed
-                queues["mastodon"].insert(0, post)
-                logger.error(f"Failed to post to Mastodon: {result}")
-
-    # Save updated queues if changes were made
     if changes_made:
-        logger.info("Saving updated queues")
-        with open(queues_path, 'w') as f:
-            json.dump(queues, f, indent=2)
+        scheduler.save_state(state, state_path)
     else:
         logger.info("No changes were made to queues")
 
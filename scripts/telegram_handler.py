@@ -2,16 +2,26 @@
 import os
 import sys
 import json
+import time
+import signal
 import argparse
-import requests
 import logging
-from datetime import datetime
-from pathlib import Path
+from datetime import datetime, timedelta
 
-# Import local modules
-from utils import get_last_update_id, save_last_update_id, send_telegram_message
-from content_processor import process_content, create_daily_entry
-from sns_manager import process_sns_queues  # Preserving SNS functionality
+# Import local modules. content_processor, sns_manager, content_index and
+# search_index are imported inside the commands and actions that use them,
+# so list_queues or an empty poll doesn't load yaml and friends
+# (benchmarks/bench_startup.py keeps an eye on startup time).
+from utils import (get_last_update_id, save_last_update_id, send_telegram_message,
+                   request_with_retry, close_http_session,
+                   vancouver_now, file_lock, TELEGRAM_API_BASE)
+import journal
+import dedup_index
+import queue_store
+import scheduler
+import metrics
+from reply_buffer import ReplyBuffer, split_message
+from media_store import media_items
 
 # Set up logging
 logging.basicConfig(
@@ -24,16 +34,46 @@ logger = logging.getLogger("Telegram Handler")
 BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
 AUTHORIZED_USER_ID = int(os.environ.get('AUTHORIZED_USER_ID', 0))
 
-def get_updates(offset=None):
+# Long-poll timeout used by serve mode (seconds Telegram holds the request open)
+POLL_TIMEOUT = int(os.environ.get('TELEGRAM_POLL_TIMEOUT', 50))
+# Pause before retrying after a failed getUpdates call in serve mode
+ERROR_BACKOFF_SECONDS = 5
+# Longest serve mode waits between SNS queue checks
+QUEUE_RECHECK_SECONDS = 300
+# Soonest serve mode retries an urgent post that is due but failed
+URGENT_RETRY_SECONDS = 30
+# Updates fetched per getUpdates page when catching up (Telegram's maximum)
+DRAIN_PAGE_SIZE = 100
+
+class ShutdownRequested(BaseException):
+    """Raised by the signal handler to break out of a blocking long poll"""
+
+# Confirmation replies, coalesced per chat and sent off the processing path
+replies = ReplyBuffer()
+
+def _collect_queue_depth():
+    """Refresh the queue depth gauges whenever metrics are scraped"""
+    for platform in queue_store.DEFAULT_PLATFORMS:
+        metrics.QUEUE_DEPTH.set(queue_store.count(platform), platform=platform)
+
+# Serve-mode state, toggled by the signal handler and the main loop
+_shutdown_requested = False
+_batch_in_progress = False
+
+@metrics.timed("get_updates")
+def get_updates(offset=None, timeout=60, limit=None):
     """Fetch updates from Telegram"""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/getUpdates"
-    params = {"timeout": 60, "allowed_updates": ["message"]}
+    url = f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}/getUpdates"
+    params = {"timeout": timeout, "allowed_updates": ["message"]}
     if offset:
         params["offset"] = offset
-    
+    if limit:
+        params["limit"] = limit
+
     logger.info(f"Fetching updates from Telegram API with offset {offset}")
     try:
-        response = requests.get(url, params=params)
+        # Give the HTTP read a little longer than Telegram holds the long poll
+        response = request_with_retry('GET', url, params=params, timeout=timeout + 10, max_retries=2)
         data = response.json()
         if not data.get("ok"):
             logger.error(f"Error fetching updates: {data}")
@@ -42,29 +82,41 @@ def get_updates(offset=None):
         logger.error(f"Exception while fetching updates: {str(e)}")
         return {"ok": False, "error": str(e)}
 
+def _schedule_label(item):
+    """Prefix marking urgent and held-back queue items"""
+    if item.get("not_before") and item["not_before"] > time.time():
+        return f"[{datetime.fromtimestamp(item['not_before'], vancouver_now().tzinfo):%m-%d %H:%M}] "
+    if item.get("priority") == queue_store.PRIORITY_URGENT:
+        return "[now] "
+    if item.get("priority") == queue_store.PRIORITY_HIGH:
+        return "[next] "
+    return ""
+
+def format_queue_page(platform, page=1, indent=""):
+    """Format one page of a platform queue for a Telegram reply"""
+    total = queue_store.count(platform)
+    if not total:
+        return None
+    items = queue_store.list_page(platform, page)
+    start = (page - 1) * queue_store.PAGE_SIZE
+    lines = [f"{indent}{start + i + 1}. {_schedule_label(item)}{item['text'][:50]}..." for i, item in enumerate(items)]
+    pages = (total + queue_store.PAGE_SIZE - 1) // queue_store.PAGE_SIZE
+    footer = f"\nPage {page}/{pages} - send !queue_{platform} <page> for more" if pages > 1 else ""
+    return f"{platform.capitalize()} Queue ({total} items):\n" + "\n".join(lines) + footer
+
 def list_queues():
     """List all queues and their content."""
     try:
         logger.info("Listing queues")
-        with open('bot_data/queues.json', 'r', encoding='utf-8') as f:
-            queues = json.load(f)
-        
         queue_contents = []
-        
-        # Format Threads queue
-        if queues.get("threads"):
-            threads_items = [f"  {i+1}. {item['text'][:50]}..." for i, item in enumerate(queues["threads"])]
-            queue_contents.append(f"Threads Queue ({len(queues['threads'])} items):\n" + "\n".join(threads_items))
-        else:
-            queue_contents.append("Threads Queue: Empty")
-        
-        # Format Mastodon queue
-        if queues.get("mastodon"):
-            mastodon_items = [f"  {i+1}. {item['text'][:50]}..." for i, item in enumerate(queues["mastodon"])]
-            queue_contents.append(f"Mastodon Queue ({len(queues['mastodon'])} items):\n" + "\n".join(mastodon_items))
-        else:
-            queue_contents.append("Mastodon Queue: Empty")
-        
+
+        for platform in ["threads", "mastodon"]:
+            page = format_queue_page(platform, indent="  ")
+            if page:
+                queue_contents.append(page)
+            else:
+                queue_contents.append(f"{platform.capitalize()} Queue: Empty")
+
         # Send the queue contents to the authorized user
         message = "📋 **Current SNS Queues**\n\n" + "\n\n".join(queue_contents)
         send_telegram_message(AUTHORIZED_USER_ID, message)
@@ -73,173 +125,531 @@ def list_queues():
         logger.error(f"Error listing queues: {e}")
         return False
 
+def _authorized_message(update):
+    """Return the update's text or media message if it should be handled, else None"""
+    logger.info(f"Processing update ID: {update['update_id']}")
+
+    if "message" not in update:
+        return None
+
+    message = update["message"]
+    user_id = message.get("from", {}).get("id")
+
+    # Security check - only process from authorized user
+    if user_id != AUTHORIZED_USER_ID:
+        logger.warning(f"Unauthorized message from user {user_id}, ignoring")
+        return None
+
+    # Process message text, commands, or photos/files with an optional caption
+    if "text" not in message and not media_items(message):
+        return None
+
+    logger.info(f"Processing message: {message.get('text', message.get('caption', ''))[:50]}...")
+    return message
+
+def parse_day_argument(argument):
+    """Turn a !day argument into a YYYY-MM-DD string, or None if it isn't one"""
+    today = vancouver_now().date()
+    if argument in ("", "today"):
+        return today.isoformat()
+    if argument == "yesterday":
+        return (today - timedelta(days=1)).isoformat()
+    try:
+        return datetime.strptime(argument, "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        return None
+
+def handle_command(chat_id, text):
+    """Handle a '!' bot command"""
+    command = text[1:].strip().lower()
+    logger.info(f"Processing command: {command}")
+
+    if command == "queues":
+        list_queues()
+        send_telegram_message(chat_id, "Queues listed above.")
+        return True
+
+    elif command.startswith("queue_"):
+        # "!queue_threads" or "!queue_threads 2" for later pages
+        platform, _, page_arg = command[6:].partition(" ")  # Extract platform name
+        page = int(page_arg) if page_arg.strip().isdigit() else 1
+        if platform in ["threads", "mastodon", "telegram"]:
+            try:
+                message = format_queue_page(platform, max(page, 1))
+                send_telegram_message(chat_id, message or f"{platform.capitalize()} Queue is empty.")
+            except Exception as e:
+                logger.error(f"Error listing {platform} queue: {e}")
+                send_telegram_message(chat_id, f"Error listing {platform} queue: {str(e)}")
+        else:
+            send_telegram_message(chat_id, f"Unknown platform: {platform}")
+        return True
+
+    elif command.startswith("dequeue_"):
+        platform = command[8:]  # Extract platform name
+        if platform in ["threads", "mastodon", "telegram"]:
+            try:
+                # Remove first item if queue isn't empty
+                removed = queue_store.dequeue(platform)
+                if removed:
+                    send_telegram_message(chat_id, f"Removed first item from {platform} queue:\n{removed['text'][:100]}...")
+                else:
+                    send_telegram_message(chat_id, f"{platform.capitalize()} Queue is already empty.")
+            except Exception as e:
+                logger.error(f"Error dequeuing from {platform}: {e}")
+                send_telegram_message(chat_id, f"Error dequeuing from {platform}: {str(e)}")
+        else:
+            send_telegram_message(chat_id, f"Unknown platform: {platform}")
+        return True
+
+    elif command == "day" or command.startswith("day "):
+        # "!day", "!day yesterday" or "!day 2025-03-12": what was captured that day
+        date_str = parse_day_argument(command[3:].strip())
+        if date_str is None:
+            send_telegram_message(chat_id, "Usage: !day [today|yesterday|YYYY-MM-DD]")
+            return True
+        try:
+            import content_index
+            summary = content_index.format_captures(date_str)
+            for message in split_message((summary or f"Nothing captured on {date_str}.").split("\n")):
+                send_telegram_message(chat_id, message)
+        except Exception as e:
+            logger.error(f"Error looking up captures for {date_str}: {e}")
+            send_telegram_message(chat_id, f"Error looking up {date_str}: {str(e)}")
+        return True
+
+    elif command == "search" or command.startswith("search "):
+        # "!search 温哥华" or "!search rust": full-text search over all captures
+        query = text.strip()[len("!search"):].strip()
+        if not query:
+            send_telegram_message(chat_id, "Usage: !search <words>")
+            return True
+        try:
+            import search_index
+            results = search_index.search(query)
+            for message in split_message(search_index.format_results(query, results).split("\n")):
+                send_telegram_message(chat_id, message)
+        except Exception as e:
+            logger.error(f"Error searching for {query}: {e}")
+            send_telegram_message(chat_id, f"Error searching: {str(e)}")
+        return True
+
+    else:
+        send_telegram_message(chat_id, f"Unknown command: {command}")
+        return True
+
+def reply_to_result(chat_id, result):
+    """Queue the confirmation replies for one processed message"""
+    logger.info(f"Processing result: {result}")
+
+    # Check if a file was created
+    if 'file' in result:
+        logger.info(f"Created/updated file: {result['file']}")
+
+    # Send a confirmation message back to the user
+    if result.get('type') == 'pending':
+        replies.add(chat_id, "⏳ Saved, but not applied yet; it will be added on the next run")
+        return
+
+    if result.get('type') == 'daily':
+        if result.get('language') == 'zh':
+            replies.add(chat_id, f"✅ 已添加到日更: {result.get('title', '无标题')}")
+        else:
+            replies.add(chat_id, f"✅ Added to daily digest: {result.get('title', 'Untitled')}")
+
+    if result.get('media'):
+        replies.add(chat_id, f"📎 Saved {result['media']} attachment(s)")
+    if result.get('media_failed'):
+        replies.add(chat_id, f"❌ Could not download {result['media_failed']} attachment(s)")
+
+    if result.get('platforms'):
+        platform_results = result.get('platforms', [])
+        platforms_str = ", ".join(platform_results)
+        replies.add(chat_id, f"✅ Added to SNS queues: {platforms_str}")
+    for timing in result.get('unknown_timings', []):
+        replies.add(chat_id, f"⚠️ Unrecognised timing {timing}, queued for the next window "
+                             f"(use now, next, tomorrow or HH:MM)")
+
+def handle_content_messages(messages):
+    """Process content messages as one batch. Returns how many succeeded."""
+    if not messages:
+        return 0
+
+    # Process regular content as daily entry or SNS post
+    try:
+        from content_processor import process_contents
+        logger.info(f"Processing {len(messages)} messages with content_processor")
+        results = process_contents(messages)
+    except Exception as e:
+        logger.error(f"Error processing messages: {e}", exc_info=True)
+        for message in messages:
+            replies.add(message.get("chat", {}).get("id"), f"❌ Error processing your message: {str(e)}")
+        return 0
+
+    # Journaled messages are marked handled; if this fails, the next run's
+    # replay_journal marks them before looking at any update
+    try:
+        dedup_index.catch_up()
+    except Exception as e:
+        logger.error(f"Error updating the dedup index: {e}")
+
+    processed = 0
+    for message, result in zip(messages, results):
+        chat_id = message.get("chat", {}).get("id")
+        if result:
+            reply_to_result(chat_id, result)
+            processed += 1
+        else:
+            logger.warning("No result returned from content_processor")
+            replies.add(chat_id, "❌ Unable to process your message")
+    return processed
+
+def handle_updates(updates):
+    """Handle a list of updates. Returns how many were processed.
+
+    Consecutive content messages are batched so each touched file is
+    written once; a command flushes the pending batch first so commands
+    see the effects of the messages sent before them. Messages that were
+    already handled (a redelivered update) are skipped before anything
+    happens to them. The "updates" lock is held throughout, so an
+    overlapping run (or webhook delivery) can't handle the same message
+    between the dedup check and the journal append.
+    """
+    with file_lock("updates"):
+        return _handle_updates(updates)
+
+def _handle_updates(updates):
+    processed = 0
+    pending = []
+
+    messages = []
+    for update in updates:
+        message = _authorized_message(update)
+        if message is None:
+            metrics.UPDATES.inc(outcome="ignored")
+            continue
+        messages.append(message)
+
+    duplicates = dedup_index.handled(dedup_index.message_key(message) for message in messages)
+    seen = set()
+    for message in messages:
+        key = dedup_index.message_key(message)
+        if key in duplicates or key in seen:
+            logger.info(f"Skipping message {key[1]} in chat {key[0]}, already handled")
+            metrics.UPDATES.inc(outcome="duplicate")
+            continue
+        seen.add(key)
+
+        # Handle queue commands
+        if message.get("text", "").startswith('!'):
+            processed += handle_content_messages(pending)
+            pending = []
+            # Confirmations for earlier messages go out before the command's reply
+            replies.flush(wait=True)
+            # Commands aren't journaled; marking first means a redelivered
+            # command (say !dequeue_threads) runs at most once
+            dedup_index.mark([key])
+            handle_command(message.get("chat", {}).get("id"), message["text"])
+            metrics.UPDATES.inc(outcome="command")
+            processed += 1
+        else:
+            metrics.UPDATES.inc(outcome="content")
+            pending.append(message)
+
+    processed += handle_content_messages(pending)
+    # One summary reply per chat for the whole batch, sent in the background
+    replies.flush()
+    metrics.write_textfile()
+    return processed
+
+def process_updates(updates, last_update_id):
+    """Handle a batch of updates and checkpoint the highest update ID seen.
+
+    Returns a tuple of (new_update_id, updates_processed).
+    """
+    with file_lock("updates"):
+        # An overlapping run may have handled part of this batch while we waited
+        saved_update_id = get_last_update_id()
+        if saved_update_id > last_update_id:
+            updates = [update for update in updates if update["update_id"] > saved_update_id]
+            last_update_id = saved_update_id
+
+        new_update_id = last_update_id
+        for update in updates:
+            if update["update_id"] > new_update_id:
+                new_update_id = update["update_id"]
+
+        updates_processed = handle_updates(updates)
+
+        # Save the new update ID if we processed any updates
+        if new_update_id > last_update_id:
+            logger.info(f"Saving new update ID: {new_update_id}")
+            save_last_update_id(new_update_id)
+
+    return new_update_id, updates_processed
+
+def replay_journal():
+    """Apply journal events that a crashed run recorded but never projected"""
+    # Whatever was journaled counts as handled, even if projecting it failed
+    dedup_index.catch_up()
+    queue_checkpoint = json.loads(queue_store.get_meta(journal.QUEUE_CHECKPOINT_KEY) or "{}")
+    applied = min(journal.load_checkpoint("digests")["seq"], queue_checkpoint.get("seq", 0))
+    if journal.last_seq() <= applied:
+        return 0
+    from content_processor import materialize
+    logger.info(f"Replaying journal events after seq {applied}")
+    failed = materialize()
+    if failed:
+        logger.error(f"Could not apply journal events {sorted(failed)}; they will be retried")
+    return journal.last_seq() - applied
+
 def process_telegram_messages():
-    """Process new Telegram messages"""
+    """Process new Telegram messages, draining any backlog.
+
+    Updates are fetched a page (DRAIN_PAGE_SIZE) at a time until a page
+    comes back short. Each page is handled as one batch and its update ID
+    saved before the next page is requested, so memory use doesn't grow
+    with the backlog and a run that dies halfway resumes after the last
+    finished page.
+    """
+    replay_journal()
     last_update_id = get_last_update_id()
     logger.info(f"Starting to process messages with last update ID: {last_update_id}")
-    
-    updates = get_updates(last_update_id + 1)
-    
-    if not updates.get("ok"):
-        logger.error(f"Error fetching updates: {updates}")
-        return False
-    
-    new_update_id = last_update_id
+
     updates_processed = 0
-    
-    for update in updates.get("result", []):
-        update_id = update["update_id"]
-        logger.info(f"Processing update ID: {update_id}")
-        
-        if update_id > new_update_id:
-            new_update_id = update_id
-        
-        if "message" in update:
-            message = update["message"]
-            chat_id = message.get("chat", {}).get("id")
-            user_id = message.get("from", {}).get("id")
-            
-            # Security check - only process from authorized user
-            if user_id != AUTHORIZED_USER_ID:
-                logger.warning(f"Unauthorized message from user {user_id}, ignoring")
-                continue
-            
-            # Process message text or commands
-            if "text" in message:
-                text = message["text"]
-                logger.info(f"Processing message: {text[:50]}...")
-                
-                # Handle queue commands
-                if text.startswith('!'):
-                    command = text[1:].strip().lower()
-                    logger.info(f"Processing command: {command}")
-                    
-                    if command == "queues":
-                        list_queues()
-                        send_telegram_message(chat_id, "Queues listed above.")
-                        updates_processed += 1
-                        continue
-                    
-                    elif command.startswith("queue_"):
-                        platform = command[6:]  # Extract platform name
-                        if platform in ["threads", "mastodon", "telegram"]:
-                            # Load queues
-                            try:
-                                with open('bot_data/queues.json', 'r', encoding='utf-8') as f:
-                                    queues = json.load(f)
-                                
-                                # Format items in the queue
-                                if platform in queues and queues[platform]:
-                                    items = [f"{i+1}. {item['text'][:50]}..." for i, item in enumerate(queues[platform])]
-                                    message = f"{platform.capitalize()} Queue ({len(queues[platform])} items):\n" + "\n".join(items)
-                                else:
-                                    message = f"{platform.capitalize()} Queue is empty."
-                                
-                                send_telegram_message(chat_id, message)
-                            except Exception as e:
-                                logger.error(f"Error listing {platform} queue: {e}")
-                                send_telegram_message(chat_id, f"Error listing {platform} queue: {str(e)}")
-                        else:
-                            send_telegram_message(chat_id, f"Unknown platform: {platform}")
-                        updates_processed += 1
-                        continue
-                    
-                    elif command.startswith("dequeue_"):
-                        platform = command[8:]  # Extract platform name
-                        if platform in ["threads", "mastodon", "telegram"]:
-                            # Load queues
-                            try:
-                                with open('bot_data/queues.json', 'r', encoding='utf-8') as f:
-                                    queues = json.load(f)
-                                
-                                # Remove first item if queue isn't empty
-                                if platform in queues and queues[platform]:
-                                    removed = queues[platform].pop(0)
-                                    with open('bot_data/queues.json', 'w', encoding='utf-8') as f:
-                                        json.dump(queues, f, indent=2)
-                                    send_telegram_message(chat_id, f"Removed first item from {platform} queue:\n{removed['text'][:100]}...")
-                                else:
-                                    send_telegram_message(chat_id, f"{platform.capitalize()} Queue is already empty.")
-                            except Exception as e:
-                                logger.error(f"Error dequeuing from {platform}: {e}")
-                                send_telegram_message(chat_id, f"Error dequeuing from {platform}: {str(e)}")
-                        else:
-                            send_telegram_message(chat_id, f"Unknown platform: {platform}")
-                        updates_processed += 1
-                        continue
-                    
-                    else:
-                        send_telegram_message(chat_id, f"Unknown command: {command}")
-                        updates_processed += 1
-                        continue
-
-                # Process regular content as daily entry or SNS post
-                try:
-                    logger.info("Processing content with content_processor")
-                    result = process_content(message)
-                    logger.info(f"Processing result: {result}")
-                    
-                    if result:
-                        # Check if a file was created
-                        if 'file' in result:
-                            logger.info(f"Created/updated file: {result['file']}")
-                            
-                        # Send a confirmation message back to the user
-                        if result.get('type') == 'daily':
-                            if result.get('language') == 'zh':
-                                send_telegram_message(chat_id, f"✅ 已添加到日更: {result.get('title', '无标题')}")
-                            else:
-                                send_telegram_message(chat_id, f"✅ Added to daily digest: {result.get('title', 'Untitled')}")
-                        
-                        if result.get('platforms'):
-                            platform_results = result.get('platforms', [])
-                            platforms_str = ", ".join(platform_results)
-                            send_telegram_message(chat_id, f"✅ Added to SNS queues: {platforms_str}")
-                        
-                        updates_processed += 1
-                    else:
-                        logger.warning("No result returned from content_processor")
-                        send_telegram_message(chat_id, "❌ Unable to process your message")
-                except Exception as e:
-                    logger.error(f"Error processing message: {e}", exc_info=True)
-                    send_telegram_message(chat_id, f"❌ Error processing your message: {str(e)}")
-
-    
-    # Save the new update ID if we processed any updates
-    if new_update_id > last_update_id:
-        logger.info(f"Saving new update ID: {new_update_id}")
-        save_last_update_id(new_update_id)
-    
-    logger.info(f"Processed {updates_processed} updates")
+    pages = 0
+    while True:
+        # Only the first request waits for new messages; later pages are backlog
+        updates = get_updates(last_update_id + 1, timeout=0 if pages else 60, limit=DRAIN_PAGE_SIZE)
+        if not updates.get("ok"):
+            logger.error(f"Error fetching updates: {updates}")
+            break
+
+        page = updates.get("result", [])
+        pages += 1
+        last_update_id, processed = process_updates(page, last_update_id)
+        updates_processed += processed
+        if len(page) < DRAIN_PAGE_SIZE:
+            break
+        logger.info(f"Page {pages} was full, fetching more from update ID {last_update_id + 1}")
+
+    logger.info(f"Processed {updates_processed} updates from {pages} pages")
     return updates_processed > 0
 
-def main():
-    parser = argparse.ArgumentParser(description='Process Telegram messages')
-    parser.add_argument('--action', type=str, default='process', 
-                        choices=['process', 'create_daily', 'process_queues', 'list_queues'],
-                        help='Action to perform')
-    
-    args = parser.parse_args()
-    logger.info(f"Starting with action: {args.action}")
-    
+def _handle_shutdown_signal(signum, frame):
+    """Stop serve mode: interrupt an idle long poll, or finish the current batch first"""
+    global _shutdown_requested
+    logger.info(f"Received signal {signum}, shutting down")
+    _shutdown_requested = True
+    if not _batch_in_progress:
+        raise ShutdownRequested()
+
+def _postable_channels():
+    """The channels process_sns_queues drains, or none if the config can't be read"""
+    from sns_manager import postable_channels
+    import config
+    try:
+        return postable_channels(config.load())
+    except config.ConfigError:
+        # process_sns_queues logs it
+        return []
+
+def _run_queues_if_due():
+    """Post due SNS windows. Returns seconds until the queues should be checked again."""
+    global _batch_in_progress
+    from sns_manager import process_sns_queues
+    _batch_in_progress = True
+    try:
+        process_sns_queues()
+    finally:
+        _batch_in_progress = False
+
+    channels = _postable_channels()
+    wait = scheduler.seconds_until_next_window(channels, vancouver_now())
+    # Urgent posts held until a set time wake the loop up at that time; items
+    # left on a disabled channel never go out, so they don't count
+    urgent_at = queue_store.next_ready_time(channel.name for channel in channels)
+    if urgent_at is not None:
+        urgent_wait = max(urgent_at - time.time(), URGENT_RETRY_SECONDS)
+        wait = urgent_wait if wait is None else min(wait, urgent_wait)
+    # Sleep until the next window, but recheck periodically so a failed post retries
+    return QUEUE_RECHECK_SECONDS if wait is None else min(wait, QUEUE_RECHECK_SECONDS)
+
+def serve(with_queues=False):
+    """Keep one process alive and long-poll Telegram for new messages.
+
+    With with_queues, the same process also posts SNS queues, waking up
+    precisely at the next scheduled post window.
+    """
+    global _batch_in_progress
+    signal.signal(signal.SIGTERM, _handle_shutdown_signal)
+    signal.signal(signal.SIGINT, _handle_shutdown_signal)
+
+    replay_journal()
+    last_update_id = get_last_update_id()
+    logger.info(f"Serving with long polling from update ID: {last_update_id}")
+    next_queue_check = time.monotonic()
+
+    try:
+        while not _shutdown_requested:
+            timeout = POLL_TIMEOUT
+            if with_queues:
+                if time.monotonic() >= next_queue_check:
+                    next_queue_check = time.monotonic() + _run_queues_if_due()
+                # Return from the long poll in time for the next queue check
+                timeout = max(1, min(POLL_TIMEOUT, int(next_queue_check - time.monotonic()) + 1))
+
+            updates = get_updates(last_update_id + 1, timeout=timeout)
+
+            if not updates.get("ok"):
+                time.sleep(ERROR_BACKOFF_SECONDS)
+                continue
+
+            results = updates.get("result", [])
+            if not results:
+                continue
+
+            # A signal arriving mid-batch only sets the flag; the batch is
+            # finished and checkpointed before the loop exits
+            _batch_in_progress = True
+            try:
+                last_update_id, updates_processed = process_updates(results, last_update_id)
+            finally:
+                _batch_in_progress = False
+            logger.info(f"Processed {updates_processed} updates")
+
+            # An urgent post captured just now goes out without waiting for the next check
+            urgent_at = None
+            if with_queues:
+                urgent_at = queue_store.next_ready_time(channel.name for channel in _postable_channels())
+            if urgent_at is not None and urgent_at <= time.time():
+                next_queue_check = time.monotonic()
+    except ShutdownRequested:
+        pass
+    finally:
+        close_http_session()
+
+    logger.info(f"Stopped serving at update ID: {last_update_id}")
+    return True
+
+def run_action(args):
+    """Run the action selected on the command line"""
     if args.action == 'process':
         # Regular processing of new messages
         process_telegram_messages()
-    
+
+    elif args.action == 'serve':
+        # Long-running ingestion daemon
+        serve(with_queues=args.with_queues)
+
+    elif args.action == 'webhook':
+        # Receive updates over HTTP instead of polling
+        from webhook_server import run_webhook_server, register_webhook
+        replay_journal()
+        public_url = os.environ.get('WEBHOOK_PUBLIC_URL')
+        if public_url:
+            register_webhook(BOT_TOKEN, public_url)
+        run_webhook_server(handle_updates, args.host, args.port)
+
     elif args.action == 'create_daily':
         # Create daily entry if it doesn't exist
+        from content_processor import create_daily_entry
         result = create_daily_entry()
         logger.info(f"Daily entry creation result: {result}")
-    
+
     elif args.action == 'process_queues':
         # Process the SNS queues
+        from sns_manager import process_sns_queues
         result = process_sns_queues()
         logger.info(f"Queue processing result: {result}")
-    
+
     elif args.action == 'list_queues':
         # List the contents of the queues
         list_queues()
-    
+
+    elif args.action == 'replay_journal':
+        # Apply journal events the digests or queues haven't seen yet
+        replayed = replay_journal()
+        logger.info(f"Journal replay covered {replayed} events")
+
+    elif args.action == 'rebuild_digests':
+        # Regenerate every journaled digest from scratch in one pass
+        from content_processor import rebuild_digests, DAILY_DIR
+        output = args.output or DAILY_DIR
+        rebuilt, skipped = rebuild_digests(output)
+        logger.info(f"Rebuilt {rebuilt} digests in {output}")
+        if skipped:
+            logger.warning(f"Left {len(skipped)} digests with unjournaled entries as they are: "
+                           f"{', '.join(skipped)}")
+        if output == DAILY_DIR:
+            import search_index
+            search_index.sync()
+
+    elif args.action == 'index_content':
+        # Bring the content index up to date
+        import content_index
+        parsed = content_index.refresh()
+        logger.info(f"Content index refreshed, {parsed} files re-parsed")
+
+    elif args.action == 'search':
+        # Search every digest, post and 细糠 entry from the command line
+        import search_index
+        search_index.sync()
+        print(search_index.format_results(args.query, search_index.search(args.query, limit=20)))
+
+    elif args.action == 'export_search':
+        # Write the search index as sharded JSON for the site's search page
+        import search_index
+        output = args.output or search_index.EXPORT_DIR
+        search_index.sync()
+        exported = search_index.export_shards(output)
+        logger.info(f"Exported {exported} search documents to {output}")
+
+    # Make sure buffered replies are delivered before the action counts as done
+    replies.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Process Telegram messages')
+    parser.add_argument('--action', type=str, default='process',
+                        choices=['process', 'serve', 'webhook', 'create_daily', 'process_queues', 'list_queues',
+                                 'replay_journal', 'rebuild_digests', 'index_content', 'search', 'export_search'],
+                        help='Action to perform')
+    # Only listen publicly when requests can be authenticated with the secret
+    default_host = '0.0.0.0' if os.environ.get('TELEGRAM_WEBHOOK_SECRET') else '127.0.0.1'
+    parser.add_argument('--host', type=str, default=os.environ.get('WEBHOOK_HOST', default_host),
+                        help='Address the webhook receiver listens on (0.0.0.0 needs TELEGRAM_WEBHOOK_SECRET)')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('WEBHOOK_PORT', 8443)),
+                        help='Port the webhook receiver listens on')
+    parser.add_argument('--with-queues', action='store_true',
+                        help='In serve mode, also post SNS queues at their scheduled windows')
+    parser.add_argument('--metrics-port', type=int, default=int(os.environ.get('METRICS_PORT', 0)),
+                        help='Expose Prometheus metrics on 127.0.0.1:<port>/metrics (0 disables)')
+    parser.add_argument('--query', type=str, default='',
+                        help='Words to look for with --action search')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Directory --action export_search writes the JSON shards to (default: static/search), '
+                             'or --action rebuild_digests writes the digests to (default: content/daily)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Run the action under cProfile (including the threads it starts) and tracemalloc '
+                             'and write reports to profiles/')
+
+    args = parser.parse_args()
+    logger.info(f"Starting with action: {args.action}")
+
+    if args.metrics_port:
+        # Only a scraper needs live queue depths; runs that just write the
+        # textfile don't open queues.db for them
+        metrics.register_collector(_collect_queue_depth)
+        metrics.serve_metrics(args.metrics_port)
+        logger.info(f"Serving metrics on 127.0.0.1:{args.metrics_port}/metrics")
+
+    if args.profile:
+        # Lazily imported so normal runs don't load cProfile/tracemalloc
+        from profiling import profile_call
+        profile_call(args.action, run_action, args)
+    else:
+        run_action(args)
+
+    metrics.write_textfile()
     logger.info(f"Completed action: {args.action}")
     # Always return success to avoid GitHub Actions failures
     return 0
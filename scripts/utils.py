@@ -1,9 +1,194 @@
 # scripts/utils.py
 import os
 import re
-import requests
 import json
-from datetime import datetime
+import time
+import fcntl
+import hashlib
+import random
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from zoneinfo import ZoneInfo
+
+import metrics
+
+# Base URL of the Bot API; overridable to point at a local stand-in server
+TELEGRAM_API_BASE = os.environ.get('TELEGRAM_API_BASE', 'https://api.telegram.org').rstrip('/')
+
+# Shared HTTP session so repeated calls reuse the same keep-alive connection
+_http_session = None
+
+def get_http_session():
+    """Return the process-wide requests session, creating it on first use"""
+    global _http_session
+    if _http_session is None:
+        # Imported on first use: requests is most of the CLI's import time,
+        # and --help, search or index_content never touch the network
+        import requests
+        _http_session = requests.Session()
+    return _http_session
+
+def close_http_session():
+    """Close the process-wide requests session if one was opened"""
+    global _http_session
+    if _http_session is not None:
+        _http_session.close()
+        _http_session = None
+
+# Outbound rate limits per host: (tokens per second, burst size)
+HOST_RATE_LIMITS = {
+    "api.telegram.org": (25, 30),
+}
+DEFAULT_RATE_LIMIT = (5, 10)
+
+# Responses worth retrying; 429 honours Retry-After, the rest back off
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a host whose circuit breaker is open"""
+
+class CircuitBreaker:
+    """Stop calling a host after repeated failures, then probe it again after a cool-down"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """True if a request may go out (closed, or half-open after the cool-down)"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                # (Re)open; a failed half-open probe restarts the cool-down
+                self.opened_at = time.monotonic()
+
+_token_buckets = {}
+_circuit_breakers = {}
+_outbound_lock = threading.Lock()
+
+def get_token_bucket(host):
+    """Return the shared rate limiter for a host"""
+    with _outbound_lock:
+        if host not in _token_buckets:
+            _token_buckets[host] = TokenBucket(*HOST_RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT))
+        return _token_buckets[host]
+
+def get_circuit_breaker(host):
+    """Return the shared circuit breaker for a host"""
+    with _outbound_lock:
+        if host not in _circuit_breakers:
+            _circuit_breakers[host] = CircuitBreaker()
+        return _circuit_breakers[host]
+
+def backoff_delay(attempt, base=0.5, maximum=30):
+    """Full-jitter exponential backoff for the given 0-based attempt"""
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+def retry_after_seconds(response):
+    """Seconds a 429/503 response asks us to wait, or None"""
+    value = response.headers.get('Retry-After')
+    if value:
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            # HTTP-date form; rare enough that email.utils isn't imported up front
+            from email.utils import parsedate_to_datetime
+            try:
+                return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+            except (TypeError, ValueError):
+                pass
+    # Telegram puts it in the JSON body instead
+    try:
+        return float(response.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def request_with_retry(method, url, session=None, max_retries=3, max_wait=60, **kwargs):
+    """Make an HTTP request through the shared outbound layer.
+
+    Each attempt takes a token from the host's bucket and is refused while the
+    host's circuit breaker is open. Connection errors and RETRY_STATUSES are
+    retried with jittered exponential backoff (or the server's Retry-After, up
+    to max_wait seconds). Returns the last response; raises the last
+    connection error or CircuitOpenError.
+    """
+    import requests
+    session = session or get_http_session()
+    host = urlparse(url).hostname
+    bucket = get_token_bucket(host)
+    breaker = get_circuit_breaker(host)
+
+    for attempt in range(max_retries + 1):
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {host}")
+        bucket.acquire()
+
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            breaker.record_failure()
+            if attempt == max_retries:
+                raise
+            delay = backoff_delay(attempt)
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                breaker.record_success()
+                return response
+            # Being rate limited says nothing about the host being down
+            if response.status_code != 429:
+                breaker.record_failure()
+            if attempt == max_retries:
+                return response
+            delay = retry_after_seconds(response)
+            if delay is None:
+                delay = backoff_delay(attempt)
+            elif delay > max_wait:
+                return response
+            # Give the connection back to the pool; a streamed body that is
+            # never read would otherwise keep it checked out
+            response.close()
+
+        time.sleep(delay)
 
 def slugify(text):
     """Convert text to a URL-friendly slug"""
@@ -19,6 +204,7 @@ def slugify(text):
     text = text.strip('-')
     return text
 
+@metrics.timed("send_telegram_message")
 def send_telegram_message(chat_id, text):
     """Send a message via Telegram"""
     bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
@@ -26,7 +212,7 @@ def send_telegram_message(chat_id, text):
         print("Error: TELEGRAM_BOT_TOKEN not set")
         return False
     
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+    url = f"{TELEGRAM_API_BASE}/bot{bot_token}/sendMessage"
     payload = {
         "chat_id": chat_id,
         "text": text,
@@ -34,10 +220,12 @@ def send_telegram_message(chat_id, text):
     }
     
     try:
-        response = requests.post(url, json=payload)
+        response = request_with_retry('POST', url, json=payload, timeout=30)
+        metrics.TELEGRAM_SENDS.inc(result="ok" if response.status_code == 200 else "error")
         return response.status_code == 200
     except Exception as e:
         print(f"Error sending Telegram message: {e}")
+        metrics.TELEGRAM_SENDS.inc(result="error")
         return False
 
 def get_last_update_id():
@@ -50,35 +238,93 @@ def get_last_update_id():
 
 def save_last_update_id(update_id):
     """Save the last processed Telegram update ID"""
-    os.makedirs('bot_data', exist_ok=True)
-    with open('bot_data/last_update_id.txt', 'w') as f:
-        f.write(str(update_id))
+    atomic_write_text('bot_data/last_update_id.txt', str(update_id))
+
+# Runs of CJK Unified Ideographs, the range counted as Chinese
+CHINESE_RUN_PATTERN = re.compile(r'[\u4e00-\u9fff]+')
+# Share of Chinese characters above which text counts as Chinese
+CHINESE_RATIO_THRESHOLD = 0.2
+
+# Texts at least this long are cached by content hash (shorter ones are
+# cheaper to count than to hash)
+LANGUAGE_CACHE_MIN_LENGTH = 512
+LANGUAGE_CACHE_SIZE = 1024
+# Sampling mode: texts at least this long are judged from evenly spaced
+# windows, falling back to a full count when the sample is near the threshold
+LANGUAGE_SAMPLE_MIN_LENGTH = 8192
+LANGUAGE_SAMPLE_WINDOWS = 8
+LANGUAGE_SAMPLE_WINDOW_SIZE = 512
+LANGUAGE_SAMPLE_MARGIN = 0.1
+
+_language_cache = OrderedDict()
+_language_cache_lock = threading.Lock()
+
+def count_chinese_chars(text):
+    """Number of characters in the U+4E00-U+9FFF range"""
+    if text.isascii():
+        return 0
+    return sum(map(len, CHINESE_RUN_PATTERN.findall(text)))
+
+def _language_from_counts(chinese_char_count, total_count):
+    # Skip empty text
+    if total_count == 0:
+        return 'zh'  # Default to Chinese
+    # If more than 20% Chinese characters, consider it Chinese
+    return 'zh' if chinese_char_count / total_count > CHINESE_RATIO_THRESHOLD else 'en'
 
-def detect_language(text):
+def _sampled_language(text):
+    """Judge a long text from windows; None if the sample is too close to call"""
+    step = len(text) // LANGUAGE_SAMPLE_WINDOWS
+    chinese_char_count = 0
+    total_count = 0
+    for i in range(LANGUAGE_SAMPLE_WINDOWS):
+        window = text[i * step:i * step + LANGUAGE_SAMPLE_WINDOW_SIZE]
+        chinese_char_count += count_chinese_chars(window)
+        total_count += len(window)
+        # Stop early once half the windows agree by a wide margin
+        if i + 1 >= LANGUAGE_SAMPLE_WINDOWS // 2:
+            ratio = chinese_char_count / total_count
+            if ratio > CHINESE_RATIO_THRESHOLD + LANGUAGE_SAMPLE_MARGIN:
+                return 'zh'
+            if ratio < CHINESE_RATIO_THRESHOLD - LANGUAGE_SAMPLE_MARGIN:
+                return 'en'
+    return None
+
+def detect_language(text, sample=False):
     """
     Detect if text is primarily Chinese or English.
     Returns 'zh' for Chinese, 'en' for English.
+
+    With sample=True, very long texts are judged from evenly spaced windows
+    and only fully counted when the sample is close to the threshold.
+    Sampled verdicts are never cached, so exact calls stay exact.
     """
     # Simple detection: if more than 20% of characters are Chinese, consider it Chinese
-    chinese_char_count = 0
-    total_count = 0
-    
-    for char in text:
-        if ord(char) > 127:  # Non-ASCII character
-            # Check if it's in common Chinese character range
-            if '\u4e00' <= char <= '\u9fff':
-                chinese_char_count += 1
-        total_count += 1
-    
-    # Skip empty text
-    if total_count == 0:
+    if not text:
         return 'zh'  # Default to Chinese
-    
-    # If more than 20% Chinese characters, consider it Chinese
-    if chinese_char_count / total_count > 0.2:
-        return 'zh'
-    else:
+    if text.isascii():
         return 'en'
+    if len(text) < LANGUAGE_CACHE_MIN_LENGTH:
+        return _language_from_counts(count_chinese_chars(text), len(text))
+
+    key = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+    with _language_cache_lock:
+        if key in _language_cache:
+            _language_cache.move_to_end(key)
+            return _language_cache[key]
+
+    if sample and len(text) >= LANGUAGE_SAMPLE_MIN_LENGTH:
+        language = _sampled_language(text)
+        if language is not None:
+            # An estimate; only exact counts go in the cache
+            return language
+    language = _language_from_counts(count_chinese_chars(text), len(text))
+
+    with _language_cache_lock:
+        _language_cache[key] = language
+        if len(_language_cache) > LANGUAGE_CACHE_SIZE:
+            _language_cache.popitem(last=False)
+    return language
 
 def format_reminder_message(untagged_thoughts):
     """Format reminder message based on the language of each thought"""
@@ -127,7 +373,100 @@ def ensure_directory_exists(filepath):
         os.makedirs(directory, exist_ok=True)
     return True
 
-def format_time_difference(timestamp_str):
+def atomic_write_text(filepath, text):
+    """Replace a file's contents via a temp file + rename so a crash never leaves it truncated"""
+    ensure_directory_exists(filepath)
+    directory = os.path.dirname(filepath) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(filepath)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return True
+
+def append_text(filepath, text):
+    """Append text to an existing file in one O_APPEND write, rolling back a partial write"""
+    data = text.encode('utf-8')
+    fd = os.open(filepath, os.O_WRONLY | os.O_APPEND)
+    try:
+        original_size = os.fstat(fd).st_size
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+            os.fsync(fd)
+        except BaseException:
+            # Never leave half a section behind
+            os.ftruncate(fd, original_size)
+            raise
+    finally:
+        os.close(fd)
+    return True
+
+# Advisory locks shared by every process working on this checkout
+LOCK_DIR = 'bot_data/locks'
+
+# Locks the current thread holds, so nested file_lock() calls don't deadlock
+_held_locks = threading.local()
+
+@contextmanager
+def file_lock(name, blocking=True):
+    """Hold an exclusive fcntl lock named after a resource (a key or a file path).
+    
+    The lock lives in its own file under LOCK_DIR, so it survives the
+    resource being replaced by atomic_write_text. It excludes other
+    processes and other threads, and is re-entrant within a thread. With
+    blocking=False, yields False instead of waiting if someone else holds it.
+    """
+    lock_name = name.replace(os.sep, '_').lstrip('_.') + '.lock'
+    held = _held_locks.__dict__.setdefault('names', {})
+    if held.get(lock_name):
+        held[lock_name] += 1
+        try:
+            yield True
+        finally:
+            held[lock_name] -= 1
+        return
+    
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    fd = os.open(os.path.join(LOCK_DIR, lock_name), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            acquired = False
+        else:
+            acquired = True
+        if not acquired:
+            yield False
+            return
+        held[lock_name] = 1
+        try:
+            yield True
+        finally:
+            held[lock_name] = 0
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+# Daily digests and SNS post windows run on Vancouver time
+VANCOUVER_TZ = ZoneInfo('America/Vancouver')
+
+def vancouver_now():
+    """Current time in Vancouver (Pacific Time)."""
+    return datetime.now(VANCOUVER_TZ)
+
+def format_time_difference(timestamp_str, language="en"):
     """Format time difference between timestamp and now"""
     timestamp = datetime.fromisoformat(timestamp_str)
     now = datetime.now()
@@ -135,24 +474,24 @@ def format_time_difference(timestamp_str):
     delta = now - timestamp
     
     if delta.days > 0:
-        if detect_language(str(delta.days)) == 'zh':
+        if language == 'zh':
             return f"{delta.days} 天前"
         else:
             return f"{delta.days} days ago"
     elif delta.seconds >= 3600:
         hours = delta.seconds // 3600
-        if detect_language(str(hours)) == 'zh':
+        if language == 'zh':
             return f"{hours} 小时前"
         else:
             return f"{hours} hours ago"
     elif delta.seconds >= 60:
         minutes = delta.seconds // 60
-        if detect_language(str(minutes)) == 'zh':
+        if language == 'zh':
             return f"{minutes} 分钟前"
         else:
             return f"{minutes} minutes ago"
     else:
-        if detect_language("just now") == 'zh':
+        if language == 'zh':
             return "刚刚"
         else:
             return "just now"
@@ -171,9 +510,7 @@ def load_json_file(filepath, default=None):
 def save_json_file(filepath, data):
     """Save data to a JSON file"""
     try:
-        ensure_directory_exists(filepath)
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        atomic_write_text(filepath, json.dumps(data, ensure_ascii=False, indent=2))
         return True
     except Exception as e:
         print(f"Error saving JSON file: {e}")
@@ -0,0 +1,233 @@
+# scripts/webhook_server.py
+import os
+import json
+import signal
+import asyncio
+import logging
+
+from utils import get_last_update_id, save_last_update_id, request_with_retry, TELEGRAM_API_BASE
+
+logger = logging.getLogger("Webhook Server")
+
+WEBHOOK_PATH = os.environ.get('TELEGRAM_WEBHOOK_PATH', '/telegram/webhook')
+WEBHOOK_SECRET = os.environ.get('TELEGRAM_WEBHOOK_SECRET')
+# Without a secret anyone who can reach the port could post updates, so
+# the receiver then only listens on these addresses
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+# Processed update IDs remembered above the checkpoint; a gap that never
+# fills (an update type we don't subscribe to) can't stall it for longer
+MAX_SEEN_UPDATE_IDS = 10000
+# Largest request body accepted; Telegram updates are a few KB at most
+MAX_BODY_BYTES = 1024 * 1024
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 401: "Unauthorized",
+               404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large"}
+
+async def _read_request(reader):
+    """Read one HTTP/1.1 request. Returns (method, path, headers, body)."""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_BYTES:
+        return method, path, headers, None
+    body = await reader.readexactly(length) if length else b''
+    return method, path, headers, body
+
+async def _write_response(writer, status, body=b''):
+    """Write a minimal HTTP response and close the connection"""
+    writer.write(
+        f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: close\r\n\r\n".encode('latin-1') + body
+    )
+    await writer.drain()
+    writer.close()
+
+class WebhookReceiver:
+    """Accept Telegram webhook POSTs and feed them to an update handler.
+
+    Requests are acknowledged as soon as the body is parsed. Whatever has
+    arrived by the time the worker is free is handled as one batch, in
+    update order, on a worker thread so the event loop stays free to
+    accept the rest of a burst.
+
+    Concurrent deliveries arrive out of order, so an update is only
+    skipped if its own ID was seen before; the saved update ID advances
+    over the contiguous run of processed IDs. With nothing saved yet (a
+    fresh checkout), it starts just below the first batch, since Telegram's
+    update IDs don't start at 1. Redeliveries after a restart are caught
+    by the dedup index in handle_updates.
+    """
+
+    def __init__(self, handle_updates, secret=WEBHOOK_SECRET, path=WEBHOOK_PATH):
+        self.handle_updates = handle_updates
+        self.secret = secret
+        self.path = path
+        self.queue = asyncio.Queue()
+        self.last_update_id = get_last_update_id()
+        # Processed IDs above last_update_id
+        self.seen = set()
+        # Lowest ID of the first batch when last_update_id was seeded from it;
+        # IDs below it that arrive late were never processed
+        self.seeded_from = None
+
+    def already_processed(self, update_id):
+        if update_id in self.seen:
+            return True
+        if self.seeded_from is not None and update_id < self.seeded_from:
+            return False
+        return update_id <= self.last_update_id
+
+    def mark_processed(self, update_ids):
+        """Record processed IDs and advance last_update_id over the contiguous prefix"""
+        if not self.last_update_id and not self.seen:
+            self.seeded_from = min(update_ids)
+            self.last_update_id = self.seeded_from - 1
+        self.seen.update(update_id for update_id in update_ids if update_id > self.last_update_id)
+        while len(self.seen) > MAX_SEEN_UPDATE_IDS:
+            lowest = min(self.seen)
+            self.seen.discard(lowest)
+            self.last_update_id = lowest
+        while self.last_update_id + 1 in self.seen:
+            self.last_update_id += 1
+            self.seen.discard(self.last_update_id)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request = await _read_request(reader)
+        except (ValueError, asyncio.IncompleteReadError):
+            await _write_response(writer, 400)
+            return
+        if request is None:
+            writer.close()
+            return
+
+        method, path, headers, body = request
+        if path != self.path:
+            await _write_response(writer, 404)
+            return
+        if method != 'POST':
+            await _write_response(writer, 405)
+            return
+        if self.secret and headers.get('x-telegram-bot-api-secret-token') != self.secret:
+            logger.warning("Rejected webhook request with a bad secret token")
+            await _write_response(writer, 401)
+            return
+        if body is None:
+            await _write_response(writer, 413)
+            return
+
+        try:
+            update = json.loads(body)
+            update_id = int(update["update_id"])
+        except (ValueError, KeyError, TypeError):
+            await _write_response(writer, 400)
+            return
+
+        # Ack Telegram immediately; processing happens in the background
+        await _write_response(writer, 200, b'{"ok":true}')
+        await self.queue.put((update_id, update))
+
+    async def process_queue(self):
+        """Handle queued updates in batches, skipping redeliveries"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            updates = {}
+            for update_id, update in batch:
+                if self.already_processed(update_id):
+                    logger.info(f"Skipping already processed update {update_id}")
+                else:
+                    updates[update_id] = update
+
+            try:
+                if updates:
+                    ordered = [updates[update_id] for update_id in sorted(updates)]
+                    await loop.run_in_executor(None, self.handle_updates, ordered)
+            except Exception as e:
+                logger.error(f"Error handling webhook updates {sorted(updates)}: {e}", exc_info=True)
+            finally:
+                # Acknowledged updates are never redelivered, so they count as processed either way
+                if updates:
+                    previous = self.last_update_id
+                    self.mark_processed(updates)
+                    if self.last_update_id > previous:
+                        save_last_update_id(self.last_update_id)
+                for _ in batch:
+                    self.queue.task_done()
+
+def check_exposure(host, secret=WEBHOOK_SECRET):
+    """Raise ValueError if host would accept unauthenticated updates from other machines"""
+    if not secret and host not in LOOPBACK_HOSTS:
+        raise ValueError(f"Refusing to listen on {host} without TELEGRAM_WEBHOOK_SECRET; "
+                         f"set a secret or listen on 127.0.0.1 behind a proxy")
+
+async def serve_webhook(handle_updates, host='127.0.0.1', port=8443, stop_event=None, secret=WEBHOOK_SECRET):
+    """Run the webhook receiver until stop_event is set (or forever)."""
+    check_exposure(host, secret)
+    receiver = WebhookReceiver(handle_updates, secret)
+    server = await asyncio.start_server(receiver.handle_connection, host, port)
+    worker = asyncio.create_task(receiver.process_queue())
+    logger.info(f"Listening for Telegram webhooks on {host}:{port}{receiver.path}")
+
+    async with server:
+        if stop_event is None:
+            await server.serve_forever()
+        else:
+            await stop_event.wait()
+            # Drain updates that were already acknowledged before exiting
+            await receiver.queue.join()
+    worker.cancel()
+
+def register_webhook(bot_token, public_url, secret=WEBHOOK_SECRET):
+    """Point Telegram at our webhook URL via setWebhook.
+
+    The secret is always sent: setWebhook without one would clear it.
+    """
+    if not secret:
+        logger.error("Not registering a webhook without TELEGRAM_WEBHOOK_SECRET")
+        return False
+    payload = {"url": public_url, "allowed_updates": ["message"], "secret_token": secret}
+    try:
+        response = request_with_retry(
+            'POST', f"{TELEGRAM_API_BASE}/bot{bot_token}/setWebhook", json=payload, timeout=30)
+        data = response.json()
+        if not data.get("ok"):
+            logger.error(f"Error registering webhook: {data}")
+        return data.get("ok", False)
+    except Exception as e:
+        logger.error(f"Exception while registering webhook: {str(e)}")
+        return False
+
+def run_webhook_server(handle_updates, host='127.0.0.1', port=8443):
+    """Blocking entry point used by telegram_handler --action webhook"""
+    try:
+        check_exposure(host)
+    except ValueError as e:
+        logger.error(str(e))
+        return False
+
+    async def _main():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop_event.set)
+        await serve_webhook(handle_updates, host, port, stop_event)
+
+    asyncio.run(_main())
+    return True
@@ -0,0 +1,45 @@
+# scripts/workers.py
+"""
+Worker pool for work partitioned by destination.
+
+Work is grouped by the thing it writes to (a digest file, a queue
+platform). Each key is handled by one call on one worker thread, with its
+items in their original order, while different keys run in parallel. Two
+updates for the same day therefore land in that day's digest in the order
+they arrived, and a slow channel doesn't hold up the others.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = 4
+
+def partition(items, key):
+    """Group items by key(item), keeping first-seen key order and item order"""
+    partitions = {}
+    for item in items:
+        partitions.setdefault(key(item), []).append(item)
+    return partitions
+
+def run_partitioned(partitions, worker, max_workers=MAX_WORKERS, name="worker"):
+    """Call worker(key, items) for every partition, partitions in parallel.
+
+    Returns {key: (result, None)} or {key: (None, exception)} in partition
+    order. A single partition runs on the calling thread.
+    """
+    outcomes = {}
+    if len(partitions) <= 1:
+        for key, items in partitions.items():
+            try:
+                outcomes[key] = (worker(key, items), None)
+            except Exception as e:
+                outcomes[key] = (None, e)
+        return outcomes
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(partitions)),
+                            thread_name_prefix=name) as executor:
+        futures = {key: executor.submit(worker, key, items) for key, items in partitions.items()}
+        for key, future in futures.items():
+            try:
+                outcomes[key] = (future.result(), None)
+            except Exception as e:
+                outcomes[key] = (None, e)
+    return outcomes
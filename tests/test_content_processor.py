@@ -0,0 +1,57 @@
+# tests/test_content_processor.py
+"""
+Digest materializing and rebuilding against a throwaway bot_data/ and
+content/ tree. Run from the repository root:
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+import content_processor
+import journal
+import queue_store
+from utils import vancouver_now
+
+class RebuildDigestsTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        os.makedirs('bot_data')
+        os.makedirs(content_processor.DAILY_DIR)
+
+    def tearDown(self):
+        queue_store.close_connections()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def capture(self, text, message_id):
+        """Journal one capture without materializing it"""
+        message = {"text": text, "message_id": message_id}
+        journal.append([content_processor.capture_event(message, vancouver_now(), [])])
+
+    def test_skipped_digest_keeps_unmaterialized_captures(self):
+        self.capture("first capture", 1)
+        content_processor.materialize()
+        filename, _ = content_processor.daily_digest_info(vancouver_now())
+        with open(filename, 'a', encoding='utf-8') as f:
+            f.write("\n## 06:00\n\nwritten by hand\n")
+        self.capture("second capture", 2)
+
+        rebuilt, skipped = content_processor.rebuild_digests()
+        content_processor.materialize()
+
+        self.assertEqual((rebuilt, skipped), (0, [filename]))
+        with open(filename, encoding='utf-8') as f:
+            text = f.read()
+        self.assertIn("written by hand", text)
+        self.assertEqual(text.count("first capture"), 1)
+        self.assertEqual(text.count("second capture"), 1)
+
+if __name__ == "__main__":
+    unittest.main()